@@ -1,8 +1,6 @@
 import os
 from src.server.app import create_app
-from src.services.collector_agent import CollectorAgent
-from src.services.pc_collector import PCCollector
-from src.services.crypto_collector import CryptoCollector
+from src.services.agent import create_agent
 import threading
 
 app = create_app()
@@ -12,9 +10,7 @@ def start_collector():
     # Get server URL from environment variable or use default
     server_url = os.getenv('SERVER_URL', 'http://localhost:5000')
     
-    agent = CollectorAgent(server_url)
-    agent.add_collector(PCCollector())
-    agent.add_collector(CryptoCollector())
+    agent = create_agent(server_url)
     
     # Start collection thread
     threading.Thread(target=agent.collect_and_upload, daemon=True).start()
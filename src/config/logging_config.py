@@ -0,0 +1,157 @@
+import atexit
+from datetime import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from .settings import settings
+
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if getattr(record, 'dropped', 0):
+            entry['dropped'] = record.dropped
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most `burst` records per call site through every `interval` seconds.
+
+    Records at `max_level` or above are never dropped. The next record let
+    through after a suppressed run carries the number of records dropped.
+    """
+
+    def __init__(self, interval=10.0, burst=5, max_level=logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.max_level = max_level
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.max_level:
+            return True
+
+        key = (record.name, record.lineno)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or record.created - window[0] >= self.interval:
+                if window and window[2]:
+                    record.suppressed = window[2]
+                self._windows[key] = [record.created, 1, 0]
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves all formatting to the listener thread.
+
+    When the queue is full, records below WARNING are dropped so callers
+    never block on a backed-up writer; warnings and errors wait briefly and
+    otherwise go straight to stderr. The next record that gets through
+    carries the number dropped.
+    """
+
+    def __init__(self, log_queue, block_timeout=0.1):
+        super().__init__(log_queue)
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self._pending_drops = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        with self._lock:
+            dropped, self._pending_drops = self._pending_drops, 0
+        if dropped:
+            record.dropped = dropped
+        if self._put(record):
+            return
+
+        if dropped:
+            del record.dropped
+        with self._lock:
+            self._pending_drops += dropped
+            if record.levelno < logging.WARNING:
+                self.dropped += 1
+                self._pending_drops += 1
+        if record.levelno >= logging.WARNING:
+            sys.stderr.write(self.format(record) + '\n')
+
+    def _put(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return True
+        except queue.Full:
+            if record.levelno < logging.WARNING:
+                return False
+        try:
+            self.queue.put(record, timeout=self.block_timeout)
+            return True
+        except queue.Full:
+            return False
+
+def parse_levels(spec: str) -> dict:
+    """Parse 'src.server.routes=WARNING,werkzeug=ERROR' into {name: level}"""
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+def setup_logging():
+    """Route all logging through a queue to a background writer (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if settings.LOG_FILE:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            settings.LOG_FILE, maxBytes=10 * 1024 * 1024, backupCount=3
+        ))
+
+    if settings.LOG_FORMAT == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=10000)
+    queue_handler = _DeferredQueueHandler(log_queue)
+    queue_handler.setFormatter(formatter)  # Only used for the stderr fallback
+    queue_handler.addFilter(RateLimitFilter(
+        interval=settings.LOG_SAMPLE_INTERVAL,
+        burst=settings.LOG_SAMPLE_BURST
+    ))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(settings.LOG_LEVEL)
+    for name, level in parse_levels(settings.LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -24,4 +24,17 @@ class Settings:
         self.API_RAPIDAPI_HOST = os.getenv('API_RAPIDAPI_HOST')
         self.API_RAPIDAPI_URL = os.getenv('API_RAPIDAPI_URL')
 
+        # Agent settings
+        self.COLLECTORS = os.getenv('COLLECTORS', 'pc,crypto')  # Names from the collector registry
+        self.COLLECTOR_PLUGINS = os.getenv('COLLECTOR_PLUGINS', '')  # e.g. disk=my_package.disk:DiskCollector
+
+        # Logging settings
+        default_level = 'WARNING' if self.ENVIRONMENT == 'production' else 'INFO'
+        self.LOG_LEVEL = os.getenv('LOG_LEVEL', default_level).upper()
+        self.LOG_LEVELS = os.getenv('LOG_LEVELS', '')  # e.g. src.server.routes=DEBUG,werkzeug=WARNING
+        self.LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+        self.LOG_FILE = os.getenv('LOG_FILE')
+        self.LOG_SAMPLE_INTERVAL = float(os.getenv('LOG_SAMPLE_INTERVAL', 10))
+        self.LOG_SAMPLE_BURST = int(os.getenv('LOG_SAMPLE_BURST', 5))
+
 settings = Settings() 
\ No newline at end of file
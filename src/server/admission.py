@@ -0,0 +1,194 @@
+from collections import Counter, OrderedDict
+import logging
+import threading
+import time
+from flask import g, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Classic token bucket refilled lazily on each check"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def wait(self, now: float, amount: float = 1) -> float:
+        """Refill; return 0 if `amount` tokens are available or seconds until they are"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, now: float, amount: float = 1) -> float:
+        """Take `amount` tokens; return 0 on success or seconds until they are available"""
+        retry_after = self.wait(now, amount)
+        if not retry_after:
+            self.tokens -= amount
+        return retry_after
+
+class AdmissionController:
+    """Per-device and per-API-key rate limits plus size limits for ingest routes.
+
+    Device buckets are charged per sample and API-key buckets per request.
+    Size and API-key checks run in a before_request hook, before the body is
+    read or parsed. Buckets live in process memory, so with several workers
+    each worker enforces its own share of the limits.
+
+    Requests without an X-API-Key are only limited per device, unless
+    `limit_by_address` is set to bucket them by client address instead.
+    Behind a reverse proxy that needs werkzeug's ProxyFix so remote_addr is
+    the client and not the proxy, otherwise every device shares one bucket.
+    """
+
+    def __init__(self, device_rate=5.0, device_burst=500, key_rate=50.0, key_burst=200,
+                 max_body_bytes=256 * 1024, max_batch=500, max_buckets=10000,
+                 limit_by_address=False):
+        self.device_rate = device_rate
+        self.device_burst = device_burst
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+        self.max_body_bytes = max_body_bytes
+        self.max_batch = max_batch
+        self.max_buckets = max_buckets
+        self.limit_by_address = limit_by_address
+        self.counters = Counter()
+        self.throttled_devices = Counter()
+        self._device_buckets = OrderedDict()
+        self._key_buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app, paths):
+        """Guard POSTs to `paths` and expose /admin/ingest-stats"""
+        guarded = set(paths)
+
+        @app.before_request
+        def admit_ingest_request():
+            if request.method == 'POST' and request.path in guarded:
+                return self._admit_request()
+
+        @app.route('/admin/ingest-stats')
+        def ingest_stats():
+            """Admission counters and the most throttled devices"""
+            return jsonify(self.stats())
+
+    def check_device(self, device_id: str, samples: int = 1):
+        """Charge a device for `samples` samples; return an error response or None"""
+        return self.check_batch(samples) or self.check_devices({device_id: samples})
+
+    def check_batch(self, samples: int):
+        """Reject a request carrying more than max_batch samples in total"""
+        if samples > self.max_batch:
+            return self._reject('batch_too_large', 413,
+                                f"Batch of {samples} samples exceeds limit of {self.max_batch}")
+        return None
+
+    def check_devices(self, samples_by_device: dict):
+        """Charge every device of a batch, all or nothing; return an error response or None"""
+        charges = dict(samples_by_device)
+        admitted = g.get('device_admitted')
+        if admitted in charges:
+            charges[admitted] -= 1  # One sample was already charged from the X-Device-Id header
+        charges = {device_id: samples for device_id, samples in charges.items() if samples > 0}
+        if not charges:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            buckets = {
+                device_id: self._bucket(self._device_buckets, device_id, self.device_rate,
+                                        self.device_burst, now)
+                for device_id in charges
+            }
+            amounts = {device_id: min(samples, buckets[device_id].capacity)
+                       for device_id, samples in charges.items()}
+            throttled = {device_id: buckets[device_id].wait(now, amount)
+                         for device_id, amount in amounts.items()}
+            throttled = {device_id: wait for device_id, wait in throttled.items() if wait}
+            if not throttled:
+                for device_id, amount in amounts.items():
+                    buckets[device_id].consume(now, amount)
+                return None
+
+            for device_id in throttled:
+                if device_id in self.throttled_devices or len(self.throttled_devices) < self.max_buckets:
+                    self.throttled_devices[device_id] += 1
+
+        return self._reject('device_rate', 429,
+                            f"Rate limit exceeded for device {', '.join(sorted(throttled))}",
+                            max(throttled.values()))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'tracked_devices': len(self._device_buckets),
+                'tracked_api_keys': len(self._key_buckets),
+                'top_throttled_devices': dict(self.throttled_devices.most_common(10)),
+                'limits': {
+                    'device_rate': self.device_rate,
+                    'device_burst': self.device_burst,
+                    'key_rate': self.key_rate,
+                    'key_burst': self.key_burst,
+                    'max_body_bytes': self.max_body_bytes,
+                    'max_batch': self.max_batch
+                }
+            }
+
+    def _admit_request(self):
+        length = request.content_length
+        if length is None:
+            return self._reject('length_required', 411, "Content-Length is required")
+        if length > self.max_body_bytes:
+            return self._reject('payload_too_large', 413,
+                                f"Payload of {length} bytes exceeds limit of {self.max_body_bytes}")
+
+        api_key = request.headers.get('X-API-Key')
+        if not api_key and self.limit_by_address:
+            api_key = request.remote_addr
+        if api_key:
+            retry_after = self._consume(self._key_buckets, api_key, self.key_rate, self.key_burst)
+            if retry_after:
+                return self._reject('api_key_rate', 429, "Rate limit exceeded for API key", retry_after)
+
+        # Agents that send X-Device-Id are charged before their body is parsed
+        device_id = request.headers.get('X-Device-Id')
+        if device_id:
+            rejected = self.check_device(device_id)
+            if rejected:
+                return rejected
+            g.device_admitted = device_id
+
+        with self._lock:
+            self.counters['admitted'] += 1
+        return None
+
+    def _consume(self, buckets, key, rate, burst, amount=1):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(buckets, key, rate, burst, now)
+            return bucket.consume(now, min(amount, bucket.capacity))
+
+    def _bucket(self, buckets, key, rate, burst, now):
+        """Look up or create a bucket; the caller holds the lock"""
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= self.max_buckets:
+                buckets.popitem(last=False)  # Evict the least recently seen key
+            bucket = buckets[key] = TokenBucket(rate, burst, now)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def _reject(self, reason, status, message, retry_after=None):
+        with self._lock:
+            self.counters[reason] += 1
+        response = jsonify({"error": message})
+        response.status_code = status
+        if retry_after:
+            response.headers['Retry-After'] = str(max(1, round(retry_after)))
+        return response
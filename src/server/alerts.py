@@ -0,0 +1,312 @@
+from collections import deque
+from datetime import datetime
+import logging
+import math
+import operator
+import queue
+import threading
+import requests
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from .database import Alert, AlertRule
+
+logger = logging.getLogger(__name__)
+
+RULE_KINDS = ('threshold', 'rate', 'window_avg')
+
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le
+}
+
+class _Rule:
+    """In-memory snapshot of an AlertRule row"""
+    __slots__ = ('id', 'name', 'kind', 'field', 'compare', 'operator', 'threshold',
+                 'clear_threshold', 'window', 'device_id', 'metric_type', 'tag')
+
+    def __init__(self, row):
+        self.id = row.id
+        self.name = row.name
+        self.kind = row.kind
+        self.field = row.field
+        self.operator = row.operator
+        self.compare = OPERATORS[row.operator]
+        self.threshold = row.threshold
+        self.clear_threshold = row.threshold if row.clear_threshold is None else row.clear_threshold
+        self.window = row.window or 300
+        self.device_id = row.device_id
+        self.metric_type = row.metric_type
+        self.tag = tuple(row.tag.split('=', 1)) if row.tag else None
+
+    def matches(self, device_id, tags):
+        if self.device_id is not None and self.device_id != device_id:
+            return False
+        if self.tag is not None and (tags or {}).get(self.tag[0]) != self.tag[1]:
+            return False
+        return True
+
+class _SeriesState:
+    """Constant-size evaluation state for one (rule, series) pair"""
+    __slots__ = ('firing', 'alert_id', 'ref_value', 'ref_time', 'average', 'last_time')
+
+    def __init__(self):
+        self.firing = False
+        self.alert_id = None
+        self.ref_value = None
+        self.ref_time = None
+        self.average = None
+        self.last_time = None
+
+class WebhookNotifier:
+    """Posts alert transitions to a webhook from a background thread"""
+
+    def __init__(self, url=None, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=1000)
+        if url:
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def __call__(self, event: dict):
+        if not self.url:
+            logger.info(f"Alert {event['state']}: {event['message']}")
+            return
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            logger.warning("Alert notification queue full, dropping event")
+
+    def _run(self):
+        while True:
+            event = self._queue.get()
+            try:
+                requests.post(self.url, json=event, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Error delivering alert notification: {e}")
+
+class AlertEngine:
+    """Evaluates alert rules incrementally as samples are ingested.
+
+    Rules are cached in memory and indexed by (metric_type, field), so a
+    sample only visits the rules that can apply to it. Each series keeps a
+    fixed amount of state and the database is only written when an alert
+    changes state.
+    """
+
+    def __init__(self, db, notifier=None):
+        self.db = db
+        self.engine = db.engine
+        self.notifier = notifier or WebhookNotifier()
+        self._rules = {}
+        self._state = {}
+        self._lock = threading.Lock()
+        self.reload_rules()
+
+    def reload_rules(self):
+        """Rebuild the rule index and restore firing alerts from the database"""
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(AlertRule).where(AlertRule.enabled.is_(True))).all()
+            open_alerts = conn.execute(
+                select(Alert.id, Alert.rule_id, Alert.device_id, Alert.metric_type)
+                .where(Alert.state == 'firing')
+            ).all()
+
+        index = {}
+        for row in rows:
+            index.setdefault((row.metric_type, row.field), []).append(_Rule(row))
+
+        with self._lock:
+            self._rules = index
+            active = {rule.id for rules in index.values() for rule in rules}
+            self._state = {key: state for key, state in self._state.items() if key[0] in active}
+            for alert_id, rule_id, device_id, metric_type in open_alerts:
+                state = self._state.setdefault((rule_id, device_id, metric_type), _SeriesState())
+                state.firing = True
+                state.alert_id = alert_id
+
+    def create_rule(self, spec: dict) -> int:
+        """Validate and store a new rule"""
+        kind = spec.get('kind', 'threshold')
+        if kind not in RULE_KINDS:
+            raise ValueError(f"kind must be one of {', '.join(RULE_KINDS)}")
+        if spec.get('operator', '>') not in OPERATORS:
+            raise ValueError(f"operator must be one of {', '.join(OPERATORS)}")
+        if not spec.get('field'):
+            raise ValueError("field is required")
+        if spec.get('tag') and '=' not in spec['tag']:
+            raise ValueError("tag must be in key=value form")
+        if spec.get('window') is not None and int(spec['window']) <= 0:
+            raise ValueError("window must be a positive number of seconds")
+
+        values = {
+            'name': spec.get('name') or f"{spec['field']} {kind}",
+            'kind': kind,
+            'field': spec['field'],
+            'operator': spec.get('operator', '>'),
+            'threshold': float(spec['threshold']),
+            'clear_threshold': float(spec['clear_threshold']) if spec.get('clear_threshold') is not None else None,
+            'window': int(spec['window']) if spec.get('window') else None,
+            'device_id': spec.get('device_id'),
+            'metric_type': spec.get('metric_type'),
+            'tag': spec.get('tag')
+        }
+        rule_id = self.db.run_write(
+            lambda conn: conn.execute(insert(AlertRule).values(**values)).inserted_primary_key[0]
+        )
+        self.reload_rules()
+        return rule_id
+
+    def delete_rule(self, rule_id: int) -> bool:
+        """Disable a rule and resolve the alerts it still has firing"""
+        def write(conn):
+            deleted = conn.execute(
+                update(AlertRule).where(AlertRule.id == rule_id).values(enabled=False)
+            ).rowcount
+            if deleted:
+                conn.execute(
+                    update(Alert)
+                    .where(Alert.rule_id == rule_id, Alert.state == 'firing')
+                    .values(state='resolved', resolved_at=datetime.utcnow())
+                )
+            return deleted
+
+        deleted = self.db.run_write(write)
+        self.reload_rules()
+        return bool(deleted)
+
+    def list_rules(self):
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(AlertRule).order_by(AlertRule.id)).mappings().all()
+        return [{
+            **{key: value for key, value in row.items() if key != 'created_at'},
+            'created_at': row['created_at'].isoformat() + 'Z'
+        } for row in rows]
+
+    def list_alerts(self, state=None, limit=100):
+        query = select(Alert).order_by(Alert.triggered_at.desc()).limit(limit)
+        if state:
+            query = query.where(Alert.state == state)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).mappings().all()
+        return [{
+            **{key: value for key, value in row.items() if key not in ('triggered_at', 'resolved_at')},
+            'triggered_at': row['triggered_at'].isoformat() + 'Z',
+            'resolved_at': row['resolved_at'].isoformat() + 'Z' if row['resolved_at'] else None
+        } for row in rows]
+
+    def evaluate(self, device_id: str, metric_type: str, values: dict,
+                 timestamp: datetime = None, tags: dict = None):
+        """Feed one sample through every rule that applies to it"""
+        if not self._rules:
+            return
+
+        now = (timestamp or datetime.utcnow()).timestamp()
+        for field, value in values.items():
+            if not isinstance(value, (int, float)):
+                continue
+            for key in ((metric_type, field), (None, field)):
+                for rule in self._rules.get(key, ()):
+                    if rule.matches(device_id, tags):
+                        self._evaluate_rule(rule, device_id, metric_type, float(value), now)
+
+    def _evaluate_rule(self, rule, device_id, metric_type, value, now):
+        with self._lock:
+            state = self._state.get((rule.id, device_id, metric_type))
+            if state is None:
+                state = self._state[(rule.id, device_id, metric_type)] = _SeriesState()
+
+            if state.last_time is not None and now < state.last_time and rule.kind != 'threshold':
+                return  # Late sample, the derived state has already moved past it
+            observed = self._observe(rule, state, value, now)
+            state.last_time = now
+            if observed is None:
+                return
+
+            if not state.firing and rule.compare(observed, rule.threshold):
+                state.firing = True
+                transition = 'firing'
+            elif state.firing and not rule.compare(observed, rule.clear_threshold):
+                state.firing = False
+                transition = 'resolved'
+            else:
+                return
+
+            # Recorded under the lock so a resolve never runs before the
+            # firing insert has set alert_id
+            event = self._record_transition(rule, state, transition, device_id, metric_type, observed)
+
+        self.notifier(event)
+
+    def _observe(self, rule, state, value, now):
+        """Return the value the rule compares against its threshold"""
+        if rule.kind == 'threshold':
+            return value
+
+        if rule.kind == 'rate':
+            # Percent change against a reference point that rolls every window
+            if state.ref_value is None or now - state.ref_time >= rule.window:
+                previous = state.ref_value
+                state.ref_value, state.ref_time = value, now
+                if previous is None:
+                    return None
+                return (value - previous) / abs(previous) * 100 if previous else None
+            if not state.ref_value:
+                return None
+            return (value - state.ref_value) / abs(state.ref_value) * 100
+
+        # window_avg: time-decayed average with a time constant of one window
+        if state.average is None:
+            state.average = value
+        else:
+            alpha = 1 - math.exp(-(now - state.last_time) / rule.window)
+            state.average += alpha * (value - state.average)
+        return state.average
+
+    def _record_transition(self, rule, state, transition, device_id, metric_type, observed):
+        """Persist a state change and return the notification event for it"""
+        message = (f"{rule.name}: {device_id}/{metric_type} {rule.field} "
+                   f"{rule.kind} {observed:.2f} {rule.operator} {rule.threshold}")
+        def write(conn):
+            if transition == 'firing':
+                state.alert_id = conn.execute(insert(Alert).values(
+                    rule_id=rule.id,
+                    device_id=device_id,
+                    metric_type=metric_type,
+                    field=rule.field,
+                    value=observed,
+                    state='firing',
+                    message=message
+                )).inserted_primary_key[0]
+            elif state.alert_id is not None:
+                conn.execute(update(Alert).where(Alert.id == state.alert_id).values(
+                    state='resolved',
+                    resolved_at=datetime.utcnow()
+                ))
+
+        try:
+            self.db.run_write(write)
+        except SQLAlchemyError as e:
+            logger.error(f"Error recording alert transition: {e}")
+
+        return {
+            'alert_id': state.alert_id,
+            'rule_id': rule.id,
+            'state': transition,
+            'device_id': device_id,
+            'metric_type': metric_type,
+            'field': rule.field,
+            'value': observed,
+            'message': message
+        }
+
+class WebhookStub:
+    """Local webhook receiver that keeps the most recent notifications"""
+
+    def __init__(self, maxlen=100):
+        self.received = deque(maxlen=maxlen)
+
+    def receive(self, event: dict):
+        self.received.append({**event, 'received_at': datetime.utcnow().isoformat() + 'Z'})
+        logger.info(f"Webhook stub received alert: {event.get('message')}")
@@ -2,16 +2,17 @@ import os
 import logging
 from flask import Flask, jsonify
 from .routes import MetricsAPI
+from .profiling import Profiling
 from sqlalchemy import create_engine
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
 from .models import Base  # Make sure this imports your SQLAlchemy models
+from ..config.logging_config import setup_logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def create_app():
+    setup_logging()
     app = Flask(__name__, template_folder='../../templates')
     
     # Use PostgreSQL database URL from environment or fallback to the Render external URL
@@ -31,6 +32,16 @@ def create_app():
         # Initialize metrics API with database configuration
         metrics_api = MetricsAPI(database_url)
         metrics_api.init_routes(app)
+
+        # Opt-in profiling; when disabled no hooks are registered at all
+        if os.getenv('PROFILING_ENABLED', '').lower() in ('1', 'true'):
+            Profiling(
+                os.getenv('PROFILE_DIR', 'instance/profiles'),
+                sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', 0)),
+                slow_query_ms=float(os.getenv('SLOW_QUERY_MS', 100)),
+                token=os.getenv('PROFILING_TOKEN'),
+                max_profiles=int(os.getenv('PROFILE_MAX_FILES', 200))
+            ).init_app(app, metrics_api.db.engine)
         
         # Add error handlers
         @app.errorhandler(404)
@@ -0,0 +1,257 @@
+"""
+Cold storage for metric tables.
+
+Rows older than a cutoff are moved out of the metrics_* tables into Parquet
+files, one per table and UTC day, indexed by a small JSON manifest:
+
+    <archive_dir>/manifest.json
+    <archive_dir>/<table_name>/<YYYY-MM-DD>.parquet
+
+Run an archive pass with:
+
+    python -m src.server.archive --older-than-days 90
+"""
+import argparse
+from datetime import datetime, timedelta
+import json
+import logging
+import math
+import os
+from sqlalchemy import and_, delete, inspect, select
+
+logger = logging.getLogger(__name__)
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("Cold storage requires pyarrow (pip install pyarrow)") from e
+    return pyarrow
+
+class ColdStorage:
+    """Archives old metric rows to Parquet and reads them back for queries"""
+
+    def __init__(self, db, archive_dir, compression='zstd'):
+        self.db = db
+        self.archive_dir = os.path.abspath(archive_dir)
+        self.manifest_path = os.path.join(self.archive_dir, 'manifest.json')
+        self.compression = compression
+        self._manifest = {'tables': {}}
+        self._manifest_mtime = None
+
+    def manifest(self) -> dict:
+        """Return the manifest, reloading it if another process rewrote it"""
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime
+        except FileNotFoundError:
+            return self._manifest
+        if mtime != self._manifest_mtime:
+            with open(self.manifest_path) as f:
+                self._manifest = json.load(f)
+            self._manifest_mtime = mtime
+        return self._manifest
+
+    def archived_days(self, table_name: str, start: datetime, end: datetime) -> list:
+        """Manifest entries for the days of table_name overlapping [start, end]"""
+        days = self.manifest()['tables'].get(table_name, {}).get('days', {})
+        first, last = start.date().isoformat(), end.date().isoformat()
+        return [entry for day, entry in sorted(days.items()) if first <= day <= last]
+
+    def read(self, table_name: str, start: datetime, end: datetime, columns: list = None,
+             include_end: bool = True):
+        """Archived rows of table_name within [start, end] (or [start, end)) as a pyarrow Table, or None"""
+        entries = self.archived_days(table_name, start, end)
+        if not entries:
+            return None
+
+        pa = _pyarrow()
+        filters = [('timestamp', '>=', start), ('timestamp', '<=' if include_end else '<', end)]
+        tables = [
+            pa.parquet.read_table(os.path.join(self.archive_dir, entry['file']),
+                                  columns=columns, filters=filters)
+            for entry in entries
+        ]
+        return pa.concat_tables(tables, promote_options='default')
+
+    def read_rows(self, table_name: str, start: datetime, end: datetime) -> list:
+        """Archived rows of table_name within [start, end] as dicts, oldest first"""
+        table = self.read(table_name, start, end)
+        if table is None:
+            return []
+        return sorted(table.to_pylist(), key=lambda row: row['timestamp'])
+
+    def aggregate(self, series: list, start: datetime, end: datetime, bucket: int,
+                  percentiles: list, group_by_device: bool) -> list:
+        """Bucketed count/sum/min/max (and percentiles) over archived samples.
+
+        `series` is a list of (device_id, table_name, field) tuples. Rows are
+        returned as dicts keyed like MetricQuery's SQL results.
+        """
+        pa = _pyarrow()
+        pc = pa.compute
+        parts = []
+        for device_id, table_name, field in series:
+            # Half-open like MetricQuery's SQL, so a sample at `end` is not counted twice
+            table = self.read(table_name, start, end, columns=['timestamp', field], include_end=False)
+            if table is None or table.num_rows == 0:
+                continue
+            table = table.filter(pc.is_valid(table[field]))
+            seconds = pc.divide(pc.cast(pc.cast(table['timestamp'], pa.timestamp('us')), pa.int64()), 1000000)
+            parts.append(pa.table({
+                'device_id': pa.array([device_id] * table.num_rows, pa.string()),
+                'bucket': pc.multiply(pc.divide(seconds, bucket), bucket),
+                'value': pc.cast(table[field], pa.float64())
+            }))
+        if not parts:
+            return []
+
+        keys = ['device_id', 'bucket'] if group_by_device else ['bucket']
+        samples = pa.concat_tables(parts)
+        aggregations = [('value', name) for name in ('count', 'sum', 'min', 'max')]
+        grouped = samples.group_by(keys).aggregate(aggregations).to_pylist()
+        ranked = _nearest_rank(samples, keys, percentiles) if percentiles else {}
+
+        rows = []
+        for group in grouped:
+            row = {
+                'bucket': group['bucket'],
+                '_count': group['value_count'],
+                '_sum': group['value_sum'],
+                '_min': group['value_min'],
+                '_max': group['value_max']
+            }
+            if group_by_device:
+                row['device_id'] = group['device_id']
+            row.update(ranked.get(tuple(group[key] for key in keys), {}))
+            rows.append(row)
+        return rows
+
+    def archive(self, older_than: timedelta) -> dict:
+        """Move rows older than the cutoff (rounded down to a UTC day) into Parquet"""
+        pa = _pyarrow()
+        cutoff = datetime.combine((datetime.utcnow() - older_than).date(), datetime.min.time())
+        summary = {}
+
+        table_names = [name for name in inspect(self.db.engine).get_table_names()
+                       if name.startswith('metrics_')]
+        for table_name in table_names:
+            model = self.db.get_metric_table(table_name)
+            if model is None:
+                continue
+            table = model.__table__
+            archived = 0
+
+            while True:
+                with self.db.engine.connect() as conn:
+                    oldest = conn.execute(
+                        select(table.c.timestamp)
+                        .where(table.c.timestamp < cutoff)
+                        .order_by(table.c.timestamp)
+                        .limit(1)
+                    ).scalar()
+                    if oldest is None:
+                        break
+
+                    day_start = datetime.combine(oldest.date(), datetime.min.time())
+                    day_end = min(day_start + timedelta(days=1), cutoff)
+                    rows = conn.execute(
+                        select(table).where(and_(table.c.timestamp >= day_start,
+                                                 table.c.timestamp < day_end))
+                    ).mappings().all()
+
+                max_id = max(row['id'] for row in rows)
+                self._write_day(pa, table_name, day_start, [dict(row) for row in rows])
+
+                self.db.run_write(lambda conn: conn.execute(delete(table).where(and_(
+                    table.c.timestamp >= day_start,
+                    table.c.timestamp < day_end,
+                    table.c.id <= max_id
+                ))))
+                archived += len(rows)
+
+            if archived:
+                summary[table_name] = archived
+                logger.info(f"Archived {archived} rows from {table_name}")
+
+        return summary
+
+    def _write_day(self, pa, table_name, day_start, rows):
+        day = day_start.date().isoformat()
+        relative = os.path.join(table_name, f"{day}.parquet")
+        path = os.path.join(self.archive_dir, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        table = pa.Table.from_pylist(rows)
+        if os.path.exists(path):
+            # Late rows for a day that was already archived
+            existing = pa.parquet.read_table(path)
+            if 'id' in existing.column_names and 'id' in table.column_names:
+                # Rows already written by a run whose delete failed
+                existing = existing.filter(pa.compute.invert(pa.compute.is_in(existing['id'], table['id'])))
+            table = pa.concat_tables([existing, table], promote_options='default')
+        table = table.sort_by('timestamp')
+
+        tmp_path = path + '.tmp'
+        pa.parquet.write_table(table, tmp_path, compression=self.compression)
+        os.replace(tmp_path, path)
+
+        timestamps = table['timestamp']
+        manifest = self.manifest()
+        manifest['tables'].setdefault(table_name, {'days': {}})['days'][day] = {
+            'file': relative,
+            'rows': table.num_rows,
+            'min': pa.compute.min(timestamps).as_py().isoformat(),
+            'max': pa.compute.max(timestamps).as_py().isoformat()
+        }
+        self._save_manifest(manifest)
+
+    def _save_manifest(self, manifest):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+        self._manifest = manifest
+        self._manifest_mtime = os.stat(self.manifest_path).st_mtime
+
+def _nearest_rank(samples, keys, percentiles) -> dict:
+    """Nearest-rank percentiles per group, the same definition MetricQuery uses in SQL"""
+    ordered = samples.sort_by([(key, 'ascending') for key in keys] + [('value', 'ascending')])
+    group_keys = list(zip(*(ordered[key].to_pylist() for key in keys)))
+    values = ordered['value'].to_pylist()
+
+    result = {}
+    start = 0
+    while start < len(values):
+        end = start
+        while end < len(values) and group_keys[end] == group_keys[start]:
+            end += 1
+        total = end - start
+        result[group_keys[start]] = {
+            # Smallest value whose 1-based rank is >= total * fraction
+            name: values[start + max(math.ceil(total * float(name[1:]) / 100), 1) - 1]
+            for name in percentiles
+        }
+        start = end
+    return result
+
+def main():
+    from ..config.logging_config import setup_logging
+    from ..config.settings import settings
+    from .database import Database
+
+    parser = argparse.ArgumentParser(description="Archive old metric rows to Parquet")
+    parser.add_argument('--older-than-days', type=int,
+                        default=int(os.getenv('ARCHIVE_AFTER_DAYS', 90)))
+    parser.add_argument('--archive-dir', default=os.getenv('ARCHIVE_DIR', 'instance/archive'))
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL') or settings.DATABASE_URL)
+    args = parser.parse_args()
+
+    setup_logging()
+    storage = ColdStorage(Database(args.database_url), args.archive_dir)
+    summary = storage.archive(timedelta(days=args.older_than_days))
+    print(json.dumps(summary, indent=2))
+
+if __name__ == '__main__':
+    main()
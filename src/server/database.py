@@ -1,14 +1,21 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, DateTime, MetaData, Table, create_engine, inspect
+from sqlalchemy import Boolean, Column, Integer, String, Float, DateTime, Text, Index, MetaData, Table, create_engine, insert, inspect
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 import logging
+import threading
+from .sqlite_backend import SQLiteWriter, create_sqlite_engine
 
 Base = declarative_base()
 metadata = MetaData()
 
 logger = logging.getLogger(__name__)
 
+# Mapped classes for dynamic metric tables, shared by every Database since
+# they all register on the same declarative Base
+_metric_models = {}
+_metric_models_lock = threading.Lock()
+
 class UEFARanking(Base):
     __tablename__ = 'uefa_rankings'
 
@@ -29,12 +36,72 @@ class DeviceCommand(Base):
     executed_at = Column(DateTime, nullable=True)
     response = Column(String, nullable=True)
 
+class Device(Base):
+    __tablename__ = 'devices'
+
+    device_id = Column(String, primary_key=True)
+    first_seen = Column(DateTime, default=datetime.utcnow)
+    last_seen = Column(DateTime, nullable=False, index=True)
+    metric_types = Column(Text, nullable=False, default='[]')  # JSON list
+    latest_values = Column(Text, nullable=False, default='{}')  # JSON {metric_type: {timestamp, values}}
+
+class DeviceTag(Base):
+    __tablename__ = 'device_tags'
+    # Inverted index: (key, value) -> device_ids
+    __table_args__ = (Index('ix_device_tags_key_value', 'key', 'value', 'device_id'),)
+
+    device_id = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=False)
+
+class AlertRule(Base):
+    __tablename__ = 'alert_rules'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    kind = Column(String, nullable=False)  # threshold | rate | window_avg
+    field = Column(String, nullable=False)
+    operator = Column(String, nullable=False, default='>')
+    threshold = Column(Float, nullable=False)
+    clear_threshold = Column(Float, nullable=True)
+    window = Column(Integer, nullable=True)  # seconds, for rate and window_avg
+    device_id = Column(String, nullable=True)
+    metric_type = Column(String, nullable=True)
+    tag = Column(String, nullable=True)  # key=value
+    enabled = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Alert(Base):
+    __tablename__ = 'alerts'
+
+    id = Column(Integer, primary_key=True)
+    rule_id = Column(Integer, nullable=False, index=True)
+    device_id = Column(String, nullable=False)
+    metric_type = Column(String, nullable=False)
+    field = Column(String, nullable=False)
+    value = Column(Float, nullable=True)
+    state = Column(String, nullable=False, default='firing', index=True)
+    message = Column(String, nullable=True)
+    triggered_at = Column(DateTime, default=datetime.utcnow)
+    resolved_at = Column(DateTime, nullable=True)
+
+def _create_indexes(conn, table):
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+
 class Database:
     def __init__(self, database_url):
-        self.engine = create_engine(database_url)
+        if database_url.startswith('sqlite'):
+            # WAL-tuned engine; every write goes through one writer thread
+            self.engine = create_sqlite_engine(database_url)
+            self.writer = SQLiteWriter(self.engine)
+        else:
+            self.engine = create_engine(database_url)
+            self.writer = None
         self.metadata = metadata
-        self.session = sessionmaker(bind=self.engine)()
-        Base.metadata.create_all(self.engine)
+        # Thread-local sessions for reads; writes go through run_write/insert_rows
+        self.session = scoped_session(sessionmaker(bind=self.engine))
+        self.run_write(Base.metadata.create_all)
         self.table_cache = {}
         self.inspector = inspect(self.engine)
         logger.info(f"Database initialized with URL: {database_url}")
@@ -42,13 +109,30 @@ class Database:
     def create_metric_table(self, table_name: str, metrics: dict):
         """Dynamically create a metrics table"""
         if table_name in self.table_cache:
-            logger.info(f"Using cached table for {table_name}")
             return self.table_cache[table_name]
 
+        with _metric_models_lock:
+            metric_table = _metric_models.get(table_name)
+            if metric_table is None:
+                metric_table = _metric_models[table_name] = self._define_metric_table(table_name, metrics)
+
+            if not self.inspector.has_table(table_name):
+                logger.info(f"Creating table {table_name} in database")
+                # DDL takes the write lock too, so it goes through the writer as well
+                self.run_write(lambda conn: metric_table.__table__.create(conn, checkfirst=True))
+            else:
+                logger.debug("Table %s already exists", table_name)
+                self.run_write(lambda conn: _create_indexes(conn, metric_table.__table__))
+
+            self.table_cache[table_name] = metric_table
+        return metric_table
+
+    def _define_metric_table(self, table_name: str, metrics: dict):
         logger.info(f"Creating new table {table_name} with metrics: {metrics}")
         columns = {
             'id': Column(Integer, primary_key=True),
-            'timestamp': Column(DateTime, default=datetime.utcnow),
+            # Indexed so range scans stay cheap when samples arrive out of order
+            'timestamp': Column(DateTime, default=datetime.utcnow, index=True),
         }
         
         # Add columns based on metrics
@@ -59,24 +143,17 @@ class Database:
                 columns[key] = Column(Float)
         
         # Create table class dynamically
-        metric_table = type(
+        return type(
             f'Metrics{table_name.title().replace("_", "")}',
             (Base,),
             {
                 '__tablename__': table_name,
+                # Never reuse the ids of archived rows; history cursors rely on them
+                '__table_args__': {'sqlite_autoincrement': True},
                 **{k: v for k, v in columns.items()}
             }
         )
 
-        if not self.inspector.has_table(table_name):
-            logger.info(f"Creating table {table_name} in database")
-            metric_table.__table__.create(self.engine)
-        else:
-            logger.info(f"Table {table_name} already exists")
-
-        self.table_cache[table_name] = metric_table
-        return metric_table
-
     def get_metric_table(self, table_name: str):
         """Get existing metric table if it exists"""
         if table_name in self.table_cache:
@@ -92,8 +169,30 @@ class Database:
             }
             return self.create_metric_table(table_name, metrics)
             
-        logger.warning(f"Table {table_name} not found")
+        logger.debug("Table %s not found", table_name)
         return None
 
     def get_session(self):
-        return self.session 
\ No newline at end of file
+        return self.session
+
+    def run_write(self, fn):
+        """Run fn(connection) in a write transaction and return its result"""
+        if self.writer is not None:
+            return self.writer.submit(fn).result()
+        with self.engine.begin() as conn:
+            return fn(conn)
+
+    def insert_rows(self, table, rows: list):
+        """Insert rows into table, batched with concurrent writes on SQLite"""
+        if self.writer is not None:
+            return self.writer.insert(table, rows).result()
+        with self.engine.begin() as conn:
+            conn.execute(insert(table), rows)
+
+    def insert_batches(self, batches: list):
+        """Insert several (table, rows) batches in one transaction"""
+        if self.writer is not None:
+            return self.writer.insert_batches(batches).result()
+        with self.engine.begin() as conn:
+            for table, rows in batches:
+                conn.execute(insert(table), rows) 
\ No newline at end of file
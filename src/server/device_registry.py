@@ -0,0 +1,222 @@
+from datetime import datetime, timedelta
+import json
+import logging
+import threading
+import time
+from sqlalchemy import and_, delete, func, insert, or_, select
+from sqlalchemy.exc import SQLAlchemyError
+from .database import Device, DeviceTag
+
+logger = logging.getLogger(__name__)
+
+def parse_tag_selectors(selectors: list) -> dict:
+    """Parse ['site=dublin', 'role=edge'] into {'site': 'dublin', 'role': 'edge'}"""
+    tags = {}
+    for selector in selectors:
+        key, sep, value = selector.partition('=')
+        if not sep or not key or not value:
+            raise ValueError(f"Invalid tag selector: {selector}")
+        tags[key] = value
+    return tags
+
+class DeviceRegistry:
+    """Tracks device heartbeats and latest readings.
+
+    Ingest only touches an in-memory buffer; buffered heartbeats are written
+    with one multi-row upsert per flush.
+    """
+
+    def __init__(self, db, flush_interval=5.0, batch_size=500, offline_after=900):
+        self.db = db
+        self.engine = db.engine
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.offline_after = timedelta(seconds=offline_after)
+        self._pending = {}
+        self._latest = {}
+        self._tags = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def record(self, device_id: str, metric_type: str, values: dict, timestamp: datetime = None):
+        """Buffer a heartbeat and the latest values for one sample"""
+        now = datetime.utcnow()
+        timestamp = timestamp or now
+        with self._lock:
+            entry = self._pending.get(device_id)
+            if entry is None:
+                entry = self._pending[device_id] = {'last_seen': now, 'metrics': {}}
+            else:
+                entry['last_seen'] = now
+
+            current = entry['metrics'].get(metric_type)
+            if current is None or timestamp >= current[0]:
+                entry['metrics'][metric_type] = (timestamp, values)
+
+            due = (len(self._pending) >= self.batch_size or
+                   time.monotonic() - self._last_flush >= self.flush_interval)
+
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered heartbeats in a single upsert"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._last_flush = time.monotonic()
+
+            if not pending:
+                return
+
+            def write(conn):
+                self._load_latest(conn, [d for d in pending if d not in self._latest])
+                conn.execute(self._upsert_statement(self._merge(pending)))
+
+            try:
+                self.db.run_write(write)
+            except SQLAlchemyError as e:
+                logger.error(f"Error flushing device registry: {e}")
+                # Keep the heartbeats so the next flush retries them
+                with self._lock:
+                    for device_id, entry in pending.items():
+                        self._pending.setdefault(device_id, entry)
+
+    def tags_for(self, device_id: str) -> dict:
+        """Tags of one device, served from an in-memory copy of the tag index"""
+        if self._tags is None:
+            with self.engine.connect() as conn:
+                rows = conn.execute(select(DeviceTag.device_id, DeviceTag.key, DeviceTag.value)).all()
+            tags = {}
+            for owner, key, value in rows:
+                tags.setdefault(owner, {})[key] = value
+            self._tags = tags
+        return self._tags.get(device_id, {})
+
+    def set_tags(self, device_id: str, tags: dict):
+        """Replace all tags of a device"""
+        if not all(isinstance(key, str) and key and isinstance(value, (str, int, float))
+                   for key, value in tags.items()):
+            raise ValueError("Tags must map non-empty string keys to scalar values")
+        tags = {key: str(value) for key, value in tags.items()}
+
+        def write(conn):
+            conn.execute(delete(DeviceTag).where(DeviceTag.device_id == device_id))
+            if tags:
+                conn.execute(insert(DeviceTag), [
+                    {'device_id': device_id, 'key': key, 'value': value}
+                    for key, value in tags.items()
+                ])
+
+        self.db.run_write(write)
+        if self._tags is not None:
+            self._tags[device_id] = tags
+        return tags
+
+    def tag_match(self, tags: dict):
+        """SELECT of the device_ids carrying every key=value pair in tags"""
+        return (
+            select(DeviceTag.device_id)
+            .where(or_(*[and_(DeviceTag.key == key, DeviceTag.value == value)
+                         for key, value in tags.items()]))
+            .group_by(DeviceTag.device_id)
+            .having(func.count() == len(tags))
+        )
+
+    def devices_with_tags(self, tags: dict) -> set:
+        with self.engine.connect() as conn:
+            return set(conn.execute(self.tag_match(tags)).scalars())
+
+    def overview(self, after: str = None, limit: int = 100, status: str = None, tags: dict = None):
+        """Return one page of devices ordered by device_id"""
+        self.flush()
+
+        now = datetime.utcnow()
+        cutoff = now - self.offline_after
+        query = select(Device).order_by(Device.device_id).limit(limit + 1)
+        if after:
+            query = query.where(Device.device_id > after)
+        if status == 'online':
+            query = query.where(Device.last_seen >= cutoff)
+        elif status == 'offline':
+            query = query.where(Device.last_seen < cutoff)
+        elif status is not None:
+            raise ValueError(f"Unknown status filter: {status}")
+        if tags:
+            query = query.where(Device.device_id.in_(self.tag_match(tags)))
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).mappings().all()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            page_tags = {}
+            for device_id, key, value in conn.execute(
+                select(DeviceTag.device_id, DeviceTag.key, DeviceTag.value)
+                .where(DeviceTag.device_id.in_([row['device_id'] for row in rows]))
+            ):
+                page_tags.setdefault(device_id, {})[key] = value
+        devices = [{
+            'device_id': row['device_id'],
+            'status': 'online' if row['last_seen'] >= cutoff else 'offline',
+            'last_seen': row['last_seen'].isoformat() + 'Z',
+            'heartbeat_age_seconds': round((now - row['last_seen']).total_seconds(), 1),
+            'metric_types': json.loads(row['metric_types']),
+            'tags': page_tags.get(row['device_id'], {}),
+            'latest': json.loads(row['latest_values'])
+        } for row in rows]
+
+        return {
+            'devices': devices,
+            'next_after': devices[-1]['device_id'] if has_more else None
+        }
+
+    def _load_latest(self, conn, device_ids):
+        """Seed the merge cache from rows written before this process started"""
+        if not device_ids:
+            return
+        rows = conn.execute(
+            select(Device.device_id, Device.latest_values)
+            .where(Device.device_id.in_(device_ids))
+        )
+        for device_id, latest_values in rows:
+            self._latest[device_id] = json.loads(latest_values or '{}')
+
+    def _merge(self, pending):
+        """Fold buffered samples into the cached latest values"""
+        records = []
+        for device_id, entry in pending.items():
+            latest = self._latest.setdefault(device_id, {})
+            for metric_type, (timestamp, values) in entry['metrics'].items():
+                current = latest.get(metric_type)
+                # Compare datetimes: as strings, '12:00:00Z' sorts after '12:00:00.5Z'
+                if current is None or timestamp >= datetime.fromisoformat(current['timestamp'].rstrip('Z')):
+                    latest[metric_type] = {'timestamp': timestamp.isoformat() + 'Z', 'values': values}
+
+            records.append({
+                'device_id': device_id,
+                'first_seen': entry['last_seen'],
+                'last_seen': entry['last_seen'],
+                'metric_types': json.dumps(sorted(latest)),
+                'latest_values': json.dumps(latest, default=str)
+            })
+        return records
+
+    def _upsert_statement(self, records):
+        dialect = self.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            raise SQLAlchemyError(f"Device registry upserts are not supported on {dialect}")
+
+        stmt = insert(Device.__table__).values(records)
+        return stmt.on_conflict_do_update(
+            index_elements=[Device.device_id],
+            set_={
+                'last_seen': stmt.excluded.last_seen,
+                'metric_types': stmt.excluded.metric_types,
+                'latest_values': stmt.excluded.latest_values
+            }
+        )
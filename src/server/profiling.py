@@ -0,0 +1,209 @@
+from collections import Counter, deque
+from datetime import datetime
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from flask import g, has_request_context, jsonify, request, send_from_directory
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+MAX_TRACKED_STATEMENTS = 1000
+
+class SamplingProfiler:
+    """Samples one thread's call stack at a fixed interval from a helper thread"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+class Profiling:
+    """Opt-in request profiling, route timings and slow-query capture.
+
+    Nothing is registered unless init_app is called, so a server running
+    without profiling pays no per-request or per-query cost. The debug
+    routes and the on-demand profiling header require `token` in the
+    X-Profile-Token header; without a token they are disabled.
+    """
+
+    def __init__(self, profile_dir, sample_rate=0.0, slow_query_ms=100.0, header='X-Profile', token=None,
+                 max_profiles=200):
+        self.profile_dir = os.path.abspath(profile_dir)
+        self.max_profiles = max_profiles
+        self.sample_rate = sample_rate
+        self.slow_query_ms = slow_query_ms
+        self.header = header
+        self.token = token
+        self.routes = {}
+        self.queries = {}
+        self.recent_queries = deque(maxlen=200)
+        self._lock = threading.Lock()
+
+    def init_app(self, app, engine):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+        @app.route('/debug/profiles')
+        def list_profiles():
+            """List saved request profiles, newest first"""
+            if not self._authorized():
+                return jsonify({"error": "Profiling token required"}), 403
+            names = sorted(os.listdir(self.profile_dir), reverse=True)
+            return jsonify([name for name in names if name.endswith('.folded')])
+
+        @app.route('/debug/profiles/<name>')
+        def download_profile(name):
+            """Download a profile in collapsed-stack (flamegraph) format"""
+            if not self._authorized():
+                return jsonify({"error": "Profiling token required"}), 403
+            return send_from_directory(self.profile_dir, name, mimetype='text/plain')
+
+        @app.route('/debug/slow')
+        def slow_summary():
+            """Top routes and queries by total time"""
+            if not self._authorized():
+                return jsonify({"error": "Profiling token required"}), 403
+            try:
+                limit = int(request.args.get('limit', 10))
+            except ValueError:
+                return jsonify({"error": "limit must be an integer"}), 400
+            return jsonify(self.summary(limit))
+
+        logger.info(f"Profiling enabled (sample rate {self.sample_rate}, slow query {self.slow_query_ms}ms)")
+
+    def summary(self, limit=10):
+        with self._lock:
+            routes = sorted(self.routes.items(), key=lambda item: item[1]['total_ms'], reverse=True)
+            queries = sorted(self.queries.items(), key=lambda item: item[1]['total_ms'], reverse=True)
+            recent = list(self.recent_queries)[-limit:]
+
+        return {
+            'routes': [{
+                'route': route,
+                'count': stats['count'],
+                'avg_ms': round(stats['total_ms'] / stats['count'], 2),
+                'max_ms': round(stats['max_ms'], 2),
+                'total_ms': round(stats['total_ms'], 2)
+            } for route, stats in routes[:limit]],
+            'slow_queries': [{
+                'statement': statement,
+                'count': stats['count'],
+                'avg_ms': round(stats['total_ms'] / stats['count'], 2),
+                'max_ms': round(stats['max_ms'], 2),
+                'last_parameters': stats['last_parameters'],
+                'routes': sorted(stats['routes'])
+            } for statement, stats in queries[:limit]],
+            'recent_slow_queries': recent
+        }
+
+    def _authorized(self):
+        supplied = request.headers.get('X-Profile-Token', '')
+        return bool(self.token) and hmac.compare_digest(supplied.encode(), self.token.encode())
+
+    def _before_request(self):
+        g.profiling_start = time.perf_counter()
+        requested = request.headers.get(self.header) and self._authorized()
+        if requested or random.random() < self.sample_rate:
+            g.profiler = SamplingProfiler(threading.get_ident())
+            g.profiler.start()
+
+    def _after_request(self, response):
+        if 'profiling_start' not in g:
+            return response
+        elapsed_ms = (time.perf_counter() - g.profiling_start) * 1000
+        route = request.url_rule.rule if request.url_rule else request.path
+        with self._lock:
+            stats = self.routes.setdefault(route, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['count'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            name = self._save_profile(profiler.stop(), request.endpoint or 'unknown')
+            response.headers['X-Profile-Id'] = name
+        return response
+
+    def _save_profile(self, stacks, endpoint):
+        name = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}_{endpoint}.folded"
+        with open(os.path.join(self.profile_dir, name), 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self._prune_profiles()
+        return name
+
+    def _prune_profiles(self):
+        """Keep only the newest max_profiles files; names sort chronologically"""
+        names = sorted(name for name in os.listdir(self.profile_dir) if name.endswith('.folded'))
+        for name in names[:-self.max_profiles]:
+            try:
+                os.remove(os.path.join(self.profile_dir, name))
+            except FileNotFoundError:
+                pass  # Removed by a concurrent request
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _handle_error(self, context):
+        # A failed statement never reaches after_cursor_execute
+        starts = context.connection.info.get('query_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info['query_start'].pop()) * 1000
+        if elapsed_ms < self.slow_query_ms:
+            return
+
+        route = request.url_rule.rule if has_request_context() and request.url_rule else None
+        params = repr(parameters)[:500]
+        with self._lock:
+            stats = self.queries.get(statement)
+            if stats is None and len(self.queries) < MAX_TRACKED_STATEMENTS:
+                stats = self.queries[statement] = {
+                    'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_parameters': None, 'routes': set()
+                }
+            if stats is not None:
+                stats['count'] += 1
+                stats['total_ms'] += elapsed_ms
+                stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+                stats['last_parameters'] = params
+                if route:
+                    stats['routes'].add(route)
+            self.recent_queries.append({
+                'statement': statement,
+                'parameters': params,
+                'duration_ms': round(elapsed_ms, 2),
+                'route': route,
+                'at': datetime.utcnow().isoformat() + 'Z'
+            })
@@ -0,0 +1,221 @@
+from datetime import datetime, timedelta, timezone
+import logging
+import re
+from sqlalchemy import BigInteger, Float, String, and_, case, cast, extract, func, inspect, literal, select, union_all
+
+logger = logging.getLogger(__name__)
+
+AGGREGATIONS = {
+    'avg': func.avg,
+    'min': func.min,
+    'max': func.max,
+    'sum': func.sum,
+    'count': func.count
+}
+
+BUCKET_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+# Bucket widths Postgres can compute with date_trunc instead of epoch arithmetic
+DATE_TRUNC_UNITS = {60: 'minute', 3600: 'hour', 86400: 'day'}
+
+MAX_BUCKETS = 10000
+
+def parse_time(value: str) -> datetime:
+    """Parse an ISO-8601 timestamp (or epoch seconds) into naive UTC"""
+    try:
+        return datetime.utcfromtimestamp(float(value))
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def parse_bucket(value: str) -> int:
+    """Parse a bucket width such as '30s', '5m', '1h' or '1d' into seconds"""
+    match = re.fullmatch(r'(\d+)([smhdw]?)', value.strip())
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f"Invalid bucket width: {value}")
+    return int(match.group(1)) * BUCKET_UNITS[match.group(2) or 's']
+
+def parse_aggregations(value: str) -> list:
+    """Parse 'avg,max,p95' into validated aggregation names"""
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    for name in names:
+        if name in AGGREGATIONS:
+            continue
+        if not re.fullmatch(r'p\d+(\.\d+)?', name) or not 0 < float(name[1:]) <= 100:
+            raise ValueError(f"Unknown aggregation: {name}")
+    if not names:
+        raise ValueError("At least one aggregation is required")
+    return names
+
+class MetricQuery:
+    """Builds bucketed aggregate queries over the dynamic metric tables.
+
+    Every series matched by a selector becomes one branch of a UNION ALL, so
+    bucketing and aggregation run in the database in a single statement.
+    """
+
+    def __init__(self, db, storage=None):
+        self.db = db
+        self.storage = storage
+
+    def resolve_series(self, selector: str) -> list:
+        """Expand 'device:metric_type:field' (device may be '*') into tables"""
+        parts = selector.split(':')
+        if len(parts) != 3 or not all(parts):
+            raise ValueError(f"Invalid series selector: {selector}")
+        device_id, metric_type, field = parts
+
+        if device_id != '*':
+            return [(device_id, f"metrics_{device_id}_{metric_type}", field)]
+
+        prefix, suffix = 'metrics_', f"_{metric_type}"
+        return [
+            (name[len(prefix):-len(suffix)], name, field)
+            for name in sorted(inspect(self.db.engine).get_table_names())
+            if name.startswith(prefix) and name.endswith(suffix) and len(name) > len(prefix + suffix)
+        ]
+
+    def run(self, selector: str, start: datetime, end: datetime, bucket: int,
+            aggregations: list, group_by_device: bool = False, devices: set = None) -> list:
+        """Execute one selector and return its groups of bucketed points.
+
+        `devices`, when given, restricts the selector to those device ids
+        (e.g. the result of a tag lookup).
+        """
+        if end <= start:
+            raise ValueError("end must be after start")
+        if (end - start).total_seconds() / bucket > MAX_BUCKETS:
+            raise ValueError(f"Query would produce more than {MAX_BUCKETS} buckets")
+
+        series, branches = [], []
+        for device_id, table_name, field in self.resolve_series(selector):
+            if devices is not None and device_id not in devices:
+                continue
+            model = self.db.get_metric_table(table_name)
+            if model is None:
+                continue
+            table = model.__table__
+            if field not in table.c:
+                raise ValueError(f"Unknown field {field} in {table_name}")
+            value = table.c[field]
+            series.append((device_id, table_name, field))
+            branches.append(
+                select(
+                    literal(device_id, String).label('device_id'),
+                    self._bucket(table.c.timestamp, bucket).label('bucket'),
+                    cast(value, Float).label('value')
+                ).where(and_(
+                    table.c.timestamp >= start,
+                    table.c.timestamp < end,
+                    value.isnot(None)
+                ))
+            )
+
+        if not branches:
+            return []
+
+        rows = union_all(*branches).subquery('samples')
+        group_columns = _group_columns(rows, group_by_device)
+        percentiles = [name for name in aggregations if name not in AGGREGATIONS]
+
+        if percentiles and self._dialect() != 'postgresql':
+            # Nearest-rank percentiles from window functions
+            rows = select(
+                rows.c.device_id,
+                rows.c.bucket,
+                rows.c.value,
+                func.row_number().over(partition_by=group_columns, order_by=rows.c.value).label('rank'),
+                func.count().over(partition_by=group_columns).label('total')
+            ).subquery('ranked')
+            group_columns = _group_columns(rows, group_by_device)
+
+        # The simple aggregates are derived from these, which also lets
+        # archived buckets be merged in exactly
+        columns = [AGGREGATIONS[name](rows.c.value).label(f"_{name}")
+                   for name in ('count', 'sum', 'min', 'max')]
+        for name in percentiles:
+            fraction = float(name[1:]) / 100
+            if self._dialect() == 'postgresql':
+                columns.append(func.percentile_disc(fraction).within_group(rows.c.value).label(name))
+            else:
+                columns.append(func.min(case(
+                    (rows.c.rank >= rows.c.total * fraction, rows.c.value)
+                )).label(name))
+
+        query = select(*group_columns, *columns).group_by(*group_columns).order_by(*group_columns)
+        with self.db.engine.connect() as conn:
+            result = [dict(row) for row in conn.execute(query).mappings()]
+
+        if self.storage is not None:
+            archived = self.storage.aggregate(series, start, end, bucket, percentiles, group_by_device)
+            if archived:
+                result = _merge_buckets(result, archived, group_by_device)
+
+        groups = {}
+        for row in result:
+            key = row['device_id'] if group_by_device else None
+            row.update(count=row['_count'], sum=row['_sum'], min=row['_min'], max=row['_max'],
+                       avg=row['_sum'] / row['_count'] if row['_count'] else None)
+            groups.setdefault(key, []).append({
+                'time': datetime.utcfromtimestamp(row['bucket']).isoformat() + 'Z',
+                **{name: row[name] for name in aggregations}
+            })
+
+        return [
+            {**({'device_id': key} if group_by_device else {}), 'points': points}
+            for key, points in groups.items()
+        ]
+
+    def _dialect(self):
+        return self.db.engine.dialect.name
+
+    def _bucket(self, timestamp, width: int):
+        """Epoch seconds of the start of the bucket containing timestamp"""
+        dialect = self._dialect()
+        if dialect == 'postgresql':
+            if width in DATE_TRUNC_UNITS:
+                epoch = extract('epoch', func.date_trunc(DATE_TRUNC_UNITS[width], timestamp))
+                return cast(epoch, BigInteger)
+            epoch = func.floor(extract('epoch', timestamp) / width) * width
+            return cast(epoch, BigInteger)
+        if dialect == 'sqlite':
+            epoch = cast(func.strftime('%s', timestamp), BigInteger)
+            return (epoch // width) * width
+        raise ValueError(f"Time bucketing is not supported on {dialect}")
+
+def _merge_buckets(hot: list, archived: list, group_by_device: bool) -> list:
+    """Combine database and archive aggregates that share a bucket.
+
+    Count, sum, min and max merge exactly. A percentile for a bucket split
+    across both tiers is taken from whichever side holds more samples.
+    """
+    def key(row):
+        return (row['device_id'], row['bucket']) if group_by_device else row['bucket']
+
+    merged = {key(row): row for row in hot}
+    for row in archived:
+        current = merged.get(key(row))
+        if current is None:
+            merged[key(row)] = row
+            continue
+        larger = current if current['_count'] >= row['_count'] else row
+        for name, value in larger.items():
+            if name.startswith('p'):
+                current[name] = value
+        current['_min'] = min(current['_min'], row['_min'])
+        current['_max'] = max(current['_max'], row['_max'])
+        current['_count'] += row['_count']
+        current['_sum'] += row['_sum']
+
+    return [merged[k] for k in sorted(merged)]
+
+def _group_columns(rows, group_by_device: bool) -> list:
+    return [rows.c.device_id, rows.c.bucket] if group_by_device else [rows.c.bucket]
+
+def default_window(hours: int = 24):
+    """Return (start, end) covering the last `hours` hours"""
+    end = datetime.utcnow()
+    return end - timedelta(hours=hours), end
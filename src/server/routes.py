@@ -1,24 +1,65 @@
+from collections import Counter
 import csv
+import os
 import sqlite3
 from flask import jsonify, render_template, request
 from config import Config
 from .database import Database, UEFARanking, DeviceCommand
+from .device_registry import DeviceRegistry, parse_tag_selectors
+from .alerts import AlertEngine, WebhookNotifier, WebhookStub
+from .admission import AdmissionController
+from .archive import ColdStorage
+from .query import MetricQuery, default_window, parse_aggregations, parse_bucket, parse_time
 from datetime import datetime, timedelta
 import time
 import logging
 import json
-from sqlalchemy import desc
+from types import SimpleNamespace
+from sqlalchemy import desc, insert, literal, or_, select
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# JSON types a sample may carry as a metric value or tag value
+SCALAR_TYPES = (str, int, float, bool, type(None))
+
 class MetricsAPI:
     def __init__(self, database_url):
         self.db = Database(database_url)
         self.session = self.db.get_session()
+        self.devices = DeviceRegistry(
+            self.db,
+            offline_after=int(os.getenv('DEVICE_OFFLINE_AFTER', 900))
+        )
+        self.alerts = AlertEngine(
+            self.db,
+            notifier=WebhookNotifier(os.getenv('ALERT_WEBHOOK_URL'))
+        )
+        self.webhook_stub = WebhookStub()
+        self.storage = ColdStorage(self.db, os.getenv('ARCHIVE_DIR', 'instance/archive'))
+        self.query = MetricQuery(self.db, self.storage)
+        self.admission = AdmissionController(
+            device_rate=float(os.getenv('INGEST_DEVICE_RATE', 5)),
+            device_burst=int(os.getenv('INGEST_DEVICE_BURST', 500)),
+            key_rate=float(os.getenv('INGEST_KEY_RATE', 50)),
+            key_burst=int(os.getenv('INGEST_KEY_BURST', 200)),
+            max_body_bytes=int(os.getenv('INGEST_MAX_BYTES', 256 * 1024)),
+            max_batch=int(os.getenv('INGEST_MAX_BATCH', 500)),
+            limit_by_address=os.getenv('INGEST_LIMIT_BY_ADDRESS', '').lower() in ('1', 'true')
+        )
+        # Accepted range for agent-supplied sample timestamps
+        self.max_clock_skew = timedelta(seconds=int(os.getenv('INGEST_MAX_CLOCK_SKEW', 300)))
+        self.max_sample_age = timedelta(seconds=int(os.getenv('INGEST_MAX_SAMPLE_AGE', 7 * 86400)))
         logger.info(f"MetricsAPI initialized with database_url: {database_url}")
 
     def init_routes(self, app):
+        self.admission.init_app(app, ['/metrics/snapshot'])
+
+        @app.teardown_appcontext
+        def remove_session(exception=None):
+            # Each request thread reads through its own session; end it so
+            # the next request sees a fresh snapshot
+            self.session.remove()
+
         @app.route('/metrics/snapshot', methods=['POST'])
         def save_metrics_snapshot():
             """
@@ -33,25 +74,55 @@ class MetricsAPI:
                 },
                 "timestamp": "2024-03-05T12:00:00Z"
             }
+            or a batch, where each sample may carry its own timestamp and
+            falls back to the batch timestamp:
+            {
+                "timestamp": "2024-03-05T12:00:00Z",
+                "metrics": [{"device_id": ..., "metric_type": ..., "values": ..., "timestamp": ...}]
+            }
+            Samples without a timestamp are stamped with the server time.
+            Invalid samples in a batch are skipped and listed in `rejected`;
+            the request only fails when no sample could be stored.
             """
             data = request.json
-            logger.info(f"Received metrics snapshot: {data}")
+            logger.debug("Received metrics snapshot: %s", data)
 
-            if not self._validate_metrics_data(data):
-                logger.error(f"Invalid metrics data format: {data}")
-                return jsonify({"error": "Invalid metrics data format"}), 400
+            try:
+                samples, rejected = self._parse_samples(data)
+            except ValueError as e:
+                logger.warning("Rejected metrics snapshot: %s", e)
+                return jsonify({"error": str(e)}), 400
+
+            throttled = (self.admission.check_batch(len(samples) + len(rejected)) or
+                         self.admission.check_devices(Counter(sample['device_id'] for sample in samples)))
+            if throttled:
+                return throttled
 
             try:
-                self._handle_generic_metrics(data)
-                logger.info("Metrics saved successfully")
-                return jsonify({"message": "Metrics saved successfully"}), 200
+                unstored = self._store_samples(samples)
             except Exception as e:
                 logger.error(f"Error saving metrics: {e}")
                 return jsonify({"error": str(e)}), 500
 
+            accepted = len(samples) - len(unstored)
+            rejected = sorted(rejected + unstored, key=lambda item: item['index'])
+            if not accepted:
+                logger.warning("Rejected metrics snapshot: %s", rejected[:5])
+                error = rejected[0]['error'] if len(rejected) == 1 else f"All {len(rejected)} samples were rejected"
+                return jsonify({"error": error, "rejected": rejected}), 400
+            if rejected:
+                logger.warning("Rejected %d of %d metric samples: %s", len(rejected),
+                               accepted + len(rejected), rejected[:5])
+            logger.debug("Saved %d metric samples", accepted)
+            return jsonify({
+                "message": "Metrics saved successfully",
+                "accepted": accepted,
+                "rejected": rejected
+            }), 200
+
         @app.route('/metrics/<device_id>/<metric_type>')
         def get_device_metrics(device_id, metric_type):
-            logger.info(f"Fetching metrics for device {device_id}, type {metric_type}")
+            logger.debug("Fetching metrics for device %s, type %s", device_id, metric_type)
             try:
                 table_name = f"metrics_{device_id}_{metric_type}"
                 MetricModel = self.db.get_metric_table(table_name)
@@ -137,6 +208,121 @@ class MetricsAPI:
         def index():
             return render_template('index.html')
 
+        @app.route('/devices')
+        def list_devices():
+            """Fleet overview: status and latest readings, paginated by device_id"""
+            try:
+                limit = min(int(request.args.get('limit', 100)), 1000)
+                return jsonify(self.devices.overview(
+                    after=request.args.get('after'),
+                    limit=limit,
+                    status=request.args.get('status'),
+                    tags=parse_tag_selectors(request.args.getlist('tag'))
+                ))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            except Exception as e:
+                logger.error(f"Error fetching device overview: {e}")
+                return jsonify({"error": str(e)}), 500
+
+        @app.route('/devices/<device_id>/tags', methods=['GET', 'PUT'])
+        def device_tags(device_id):
+            """Get or replace a device's tags, e.g. {"site": "dublin", "role": "edge"}"""
+            if request.method == 'GET':
+                return jsonify(self.devices.tags_for(device_id))
+            tags = request.json
+            if not isinstance(tags, dict):
+                return jsonify({"error": "Tags must be a JSON object"}), 400
+            try:
+                return jsonify(self.devices.set_tags(device_id, tags))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            except Exception as e:
+                logger.error(f"Error saving device tags: {e}")
+                return jsonify({"error": str(e)}), 500
+
+        @app.route('/devices/command', methods=['POST'])
+        def broadcast_command():
+            """
+            Send a command to every device matching a tag selector
+            Expected format:
+            {
+                "command": "restart",
+                "tags": {"site": "dublin"}
+            }
+            """
+            data = request.json or {}
+            command, tags = data.get('command'), data.get('tags')
+            if not command:
+                return jsonify({"error": "Command is required"}), 400
+            if not tags or not isinstance(tags, dict):
+                return jsonify({"error": "A tag selector is required"}), 400
+
+            # One INSERT ... SELECT over the tag index, no per-device round trips
+            matches = self.devices.tag_match({k: str(v) for k, v in tags.items()}).subquery()
+            statement = insert(DeviceCommand).from_select(
+                ['device_id', 'command', 'status', 'created_at'],
+                select(matches.c.device_id, literal(command), literal('pending'), literal(datetime.utcnow()))
+            )
+            try:
+                count = self.db.run_write(lambda conn: conn.execute(statement).rowcount)
+                return jsonify({"message": "Command sent successfully", "device_count": count})
+            except Exception as e:
+                logger.error(f"Error broadcasting command: {e}")
+                return jsonify({"error": str(e)}), 500
+
+        @app.route('/alerts')
+        def list_alerts():
+            """List alerts, newest first, optionally filtered by state"""
+            try:
+                limit = min(int(request.args.get('limit', 100)), 1000)
+                return jsonify(self.alerts.list_alerts(request.args.get('state'), limit))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            except Exception as e:
+                logger.error(f"Error fetching alerts: {e}")
+                return jsonify({"error": str(e)}), 500
+
+        @app.route('/alerts/rules', methods=['GET', 'POST'])
+        def alert_rules():
+            """
+            List alert rules or create a new one
+            Expected format:
+            {
+                "kind": "threshold",
+                "field": "ram_usage",
+                "operator": ">",
+                "threshold": 90,
+                "clear_threshold": 85,
+                "metric_type": "system_metrics"
+            }
+            """
+            if request.method == 'GET':
+                return jsonify(self.alerts.list_rules())
+            try:
+                rule_id = self.alerts.create_rule(request.json or {})
+                return jsonify({"message": "Rule created", "rule_id": rule_id}), 201
+            except (KeyError, TypeError, ValueError) as e:
+                return jsonify({"error": f"Invalid rule: {e}"}), 400
+            except Exception as e:
+                logger.error(f"Error creating alert rule: {e}")
+                return jsonify({"error": str(e)}), 500
+
+        @app.route('/alerts/rules/<int:rule_id>', methods=['DELETE'])
+        def delete_alert_rule(rule_id):
+            """Disable an alert rule"""
+            if not self.alerts.delete_rule(rule_id):
+                return jsonify({"error": "Rule not found"}), 404
+            return jsonify({"message": "Rule deleted"})
+
+        @app.route('/alerts/webhook', methods=['GET', 'POST'])
+        def alert_webhook_stub():
+            """Local webhook target for alert notifications"""
+            if request.method == 'POST':
+                self.webhook_stub.receive(request.json or {})
+                return '', 204
+            return jsonify(list(self.webhook_stub.received))
+
         @app.route('/device/command/<device_id>', methods=['POST'])
         def send_command(device_id):
             """Send a command to a specific device."""
@@ -145,20 +331,15 @@ class MetricsAPI:
                 return jsonify({"error": "Command is required"}), 400
             
             try:
-                new_command = DeviceCommand(
-                    device_id=device_id,
-                    command=command,
-                    status='pending'
-                )
-                self.session.add(new_command)
-                self.session.commit()
+                command_id = self.db.run_write(lambda conn: conn.execute(
+                    insert(DeviceCommand).values(device_id=device_id, command=command, status='pending')
+                ).inserted_primary_key[0])
                 
                 return jsonify({
                     "message": "Command sent successfully",
-                    "command_id": new_command.id
+                    "command_id": command_id
                 })
             except Exception as e:
-                self.session.rollback()
                 logger.error(f"Error sending command: {e}")
                 return jsonify({"error": str(e)}), 500
 
@@ -219,7 +400,14 @@ class MetricsAPI:
 
         @app.route('/metrics/history/<device_id>/<metric_type>')
         def get_metrics_history(device_id, metric_type):
-            """Get historical metrics data with time range filtering"""
+            """
+            Get historical metrics data with time range filtering
+            Pass since=<cursor from a previous response> to receive only
+            rows stored after that response, including late samples whose
+            timestamps are older than rows already returned. The cursor holds
+            the highest id and timestamp seen, so rows are still found on
+            older SQLite tables that reuse the ids of archived rows.
+            """
             try:
                 # Get time range from query parameters (default to last 24 hours)
                 time_range = request.args.get('range', '24h')
@@ -235,6 +423,18 @@ class MetricsAPI:
                 else:
                     start_time = end_time - timedelta(days=1)  # Default to 24h
 
+                since = request.args.get('since') or request.args.get('cursor')
+                since_id = since_time = None
+                try:
+                    if since and since.startswith('id:'):
+                        since_id, _, stamp = since[3:].partition(':')
+                        since_id = int(since_id)
+                        since_time = parse_time(stamp) if stamp else None
+                    elif since:
+                        since_time = parse_time(since)  # Timestamp cursors from older clients
+                except ValueError:
+                    return jsonify({"error": f"Invalid since cursor: {since}"}), 400
+
                 # Get table and query data
                 table_name = f"metrics_{device_id}_{metric_type}"
                 MetricModel = self.db.get_metric_table(table_name)
@@ -243,34 +443,67 @@ class MetricsAPI:
                     return jsonify({"error": "No metrics found"}), 404
                 
                 # Query data within time range
-                metrics = (self.session.query(MetricModel)
-                          .filter(MetricModel.timestamp.between(start_time, end_time))
-                          .order_by(MetricModel.timestamp.asc())
-                          .all())
+                query = (self.session.query(MetricModel)
+                        .filter(MetricModel.timestamp.between(start_time, end_time)))
+                if since_id is not None and since_time is not None:
+                    query = query.filter(or_(MetricModel.id > since_id, MetricModel.timestamp > since_time))
+                elif since_id is not None:
+                    query = query.filter(MetricModel.id > since_id)
+                elif since_time is not None:
+                    query = query.filter(MetricModel.timestamp > since_time)
+                metrics = query.order_by(MetricModel.timestamp.asc()).all()
+
+                # Stitch in rows that have been moved to cold storage
+                if since_id is not None:
+                    archived = self.storage.read_rows(table_name, start_time, end_time)
+                    archived = [row for row in archived if row['id'] > since_id or
+                                (since_time is not None and row['timestamp'] > since_time)]
+                else:
+                    archived = self.storage.read_rows(table_name, since_time or start_time, end_time)
+                    if since_time is not None:
+                        archived = [row for row in archived if row['timestamp'] > since_time]
+                if archived:
+                    # Ids alone are not unique across tiers once SQLite reuses them
+                    hot_keys = {(m.timestamp, m.id) for m in metrics}
+                    metrics = [SimpleNamespace(**row) for row in archived
+                               if (row['timestamp'], row['id']) not in hot_keys] + metrics
+                    metrics.sort(key=lambda m: m.timestamp)
                 
                 # Format response based on metric type
                 if metric_type == 'system_metrics':
                     data = [{
+                        'id': m.id,
                         'timestamp': m.timestamp.isoformat(),
                         'ram_usage': m.ram_usage,
                         'thread_count': m.thread_count
                     } for m in metrics]
                 elif metric_type == 'crypto_prices':
                     data = [{
+                        'id': m.id,
                         'timestamp': m.timestamp.isoformat(),
                         'bitcoin_usd': m.bitcoin_usd,
                         'ethereum_usd': m.ethereum_usd
                     } for m in metrics]
                 elif metric_type == 'uefa_rankings':
                     data = [{
+                        'id': m.id,
                         'timestamp': m.timestamp.isoformat(),
                         'rankings': json.loads(m.rankings)
                     } for m in metrics]
+                else:
+                    columns = [c.name for c in MetricModel.__table__.columns if c.name not in ('id', 'timestamp')]
+                    data = [{
+                        'id': m.id,
+                        'timestamp': m.timestamp.isoformat(),
+                        **{name: getattr(m, name) for name in columns}
+                    } for m in metrics]
                 
                 return jsonify({
                     'device_id': device_id,
                     'metric_type': metric_type,
                     'time_range': time_range,
+                    'since': since,
+                    'cursor': self._history_cursor(metrics, since_id, since_time) if metrics else since,
                     'data': data
                 })
 
@@ -278,31 +511,168 @@ class MetricsAPI:
                 logger.error(f"Error fetching historical metrics: {e}", exc_info=True)
                 return jsonify({"error": str(e)}), 500
 
+        @app.route('/metrics/query')
+        def query_metrics():
+            """
+            Bucketed aggregates over any metric series, computed in the database
+            Query parameters:
+                series=device_1:system_metrics:ram_usage (repeatable, device may be *)
+                tag=site=dublin (repeatable, restricts * selectors to tagged devices)
+                start=2024-03-05T00:00:00Z&end=2024-03-06T00:00:00Z
+                bucket=5m&agg=avg,max,p95&group_by=device
+            """
+            try:
+                selectors = request.args.getlist('series')
+                if not selectors:
+                    raise ValueError("At least one series selector is required")
+                start, end = default_window()
+                if request.args.get('start'):
+                    start = parse_time(request.args['start'])
+                if request.args.get('end'):
+                    end = parse_time(request.args['end'])
+                bucket = parse_bucket(request.args.get('bucket', '1h'))
+                aggregations = parse_aggregations(request.args.get('agg', 'avg'))
+                group_by_device = request.args.get('group_by') == 'device'
+                tags = parse_tag_selectors(request.args.getlist('tag'))
+                devices = self.devices.devices_with_tags(tags) if tags else None
+
+                return jsonify({
+                    'start': start.isoformat() + 'Z',
+                    'end': end.isoformat() + 'Z',
+                    'bucket_seconds': bucket,
+                    'series': [{
+                        'selector': selector,
+                        'groups': self.query.run(selector, start, end, bucket,
+                                                 aggregations, group_by_device, devices)
+                    } for selector in selectors]
+                })
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            except Exception as e:
+                logger.error(f"Error running metrics query: {e}", exc_info=True)
+                return jsonify({"error": str(e)}), 500
+
+    def _history_cursor(self, metrics, since_id, since_time):
+        """Cursor holding the highest id and timestamp a client has received"""
+        last_id = max([m.id for m in metrics] + ([since_id] if since_id is not None else []))
+        last_time = max([m.timestamp for m in metrics] + ([since_time] if since_time is not None else []))
+        return f"id:{last_id}:{last_time.isoformat()}Z"
+
     def _validate_metrics_data(self, data):
         """Validate incoming metrics data"""
         required_fields = ['device_id', 'metric_type', 'values']
         return all(field in data for field in required_fields)
 
-    def _handle_generic_metrics(self, data):
-        """Handle generic metrics data"""
-        table_name = f"metrics_{data['device_id']}_{data['metric_type']}"
-        MetricModel = self.db.get_metric_table(table_name)
-        
-        if not MetricModel:
-            MetricModel = self.db.create_metric_table(table_name, 
-                {k: "FLOAT" if isinstance(v, (int, float)) else "TEXT" 
-                 for k, v in data['values'].items()})
-        
-        # Create new metric record
-        metric_data = {
-            'timestamp': datetime.utcnow(),
-            **data['values']
-        }
-        
-        new_metric = MetricModel(**metric_data)
-        self.session.add(new_metric)
-        self.session.commit()
-        logger.info(f"Saved generic metrics to {table_name}: {data['values']}")
+    def _parse_samples(self, data):
+        """Flatten a snapshot or batch payload into timestamped samples.
+
+        Returns (samples, rejected); a sample with a bad format or timestamp is
+        reported in `rejected` by its index without failing the rest.
+        """
+        if not isinstance(data, dict):
+            raise ValueError("Invalid metrics data format")
+        if 'metrics' in data:
+            entries = data['metrics']
+            if not isinstance(entries, list) or not entries:
+                raise ValueError("Batch must contain a non-empty metrics list")
+        else:
+            entries = [data]
+
+        now = datetime.utcnow()
+        samples, rejected = [], []
+        for index, entry in enumerate(entries):
+            try:
+                if (not isinstance(entry, dict) or not self._validate_metrics_data(entry)
+                        or not isinstance(entry['values'], dict)):
+                    raise ValueError("Invalid metrics data format")
+                self._validate_sample_fields(entry)
+                timestamp = self._sample_time(entry.get('timestamp', data.get('timestamp')), now)
+            except ValueError as e:
+                rejected.append({'index': index, 'error': str(e)})
+                continue
+            samples.append({**entry, 'index': index, 'timestamp': timestamp})
+        return samples, rejected
+
+    def _validate_sample_fields(self, entry):
+        """Reject nested values and tags that are not a flat string-keyed object"""
+        nested = sorted(key for key, value in entry['values'].items() if not isinstance(value, SCALAR_TYPES))
+        if nested:
+            raise ValueError(f"Values must be scalars: {', '.join(nested)}")
+        tags = entry.get('tags')
+        if tags is not None and not (isinstance(tags, dict) and all(
+                isinstance(key, str) and isinstance(value, SCALAR_TYPES) for key, value in tags.items())):
+            raise ValueError("Tags must be an object of scalar values")
+
+    def _sample_time(self, value, now):
+        """Parse an agent timestamp and check it against the clock-skew window"""
+        if value is None:
+            return now
+        try:
+            timestamp = parse_time(str(value))
+        except (ValueError, OverflowError, OSError):
+            raise ValueError(f"Invalid timestamp: {value}")
+        if timestamp > now + self.max_clock_skew:
+            raise ValueError(f"Timestamp {value} is more than {int(self.max_clock_skew.total_seconds())}s "
+                             f"ahead of server time")
+        if timestamp < now - self.max_sample_age:
+            raise ValueError(f"Timestamp {value} is older than the {int(self.max_sample_age.total_seconds())}s "
+                             f"ingest window")
+        return timestamp
+
+    def _store_samples(self, samples):
+        """Write samples grouped per table, then update the registry and alerts.
+
+        Returns the samples rejected for carrying fields their table lacks.
+        """
+        by_table = {}
+        for sample in samples:
+            by_table.setdefault(f"metrics_{sample['device_id']}_{sample['metric_type']}", []).append(sample)
+
+        batches, stored, rejected = {}, [], []
+        for table_name, table_samples in by_table.items():
+            MetricModel = self.db.get_metric_table(table_name)
+            if not MetricModel:
+                columns = {}
+                for sample in table_samples:
+                    for k, v in sample['values'].items():
+                        columns.setdefault(k, "FLOAT" if isinstance(v, (int, float)) else "TEXT")
+                MetricModel = self.db.create_metric_table(table_name, columns)
+
+            known = set(MetricModel.__table__.c.keys()) - {'id', 'timestamp'}
+            for sample in table_samples:
+                unknown = sorted(set(sample['values']) - known)
+                if unknown:
+                    rejected.append({
+                        'index': sample['index'],
+                        'error': f"Unknown fields for {table_name}: {', '.join(unknown)}"
+                    })
+                    continue
+                # Rows in one executemany must share their columns
+                key = (MetricModel.__table__, tuple(sorted(sample['values'])))
+                batches.setdefault(key, []).append({'timestamp': sample['timestamp'], **sample['values']})
+                stored.append(sample)
+
+        if batches:
+            self.db.insert_batches([(table, rows) for (table, _), rows in batches.items()])
+
+        # Late samples only replace a device's latest values if they are newer,
+        # and alerts see each series in event-time order. The rows are already
+        # committed, so a failure here is logged rather than failing the request.
+        device_tags = {}
+        for sample in sorted(stored, key=lambda sample: sample['timestamp']):
+            device_id = sample['device_id']
+            try:
+                self.devices.record(device_id, sample['metric_type'], sample['values'], sample['timestamp'])
+                if device_id not in device_tags:
+                    device_tags[device_id] = self.devices.tags_for(device_id)
+                tags = device_tags[device_id]
+                if sample.get('tags'):
+                    tags = {**tags, **sample['tags']}
+                self.alerts.evaluate(device_id, sample['metric_type'], sample['values'],
+                                     sample['timestamp'], tags)
+            except Exception as e:
+                logger.error(f"Error updating registry/alerts for {device_id}: {e}")
+        return rejected
 
 def get_system_metrics():
     """Legacy function to fetch system metrics."""
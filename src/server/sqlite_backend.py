@@ -0,0 +1,131 @@
+from concurrent.futures import Future
+import logging
+import os
+import queue
+import threading
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import StaticPool
+
+logger = logging.getLogger(__name__)
+
+# Applied to every new connection; journal_mode=WAL also persists in the file
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,  # 64 MB
+    'mmap_size': 268435456,  # 256 MB
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000
+}
+
+def create_sqlite_engine(database_url: str):
+    """Create a SQLite engine tuned for concurrent readers and one writer"""
+    url = make_url(database_url)
+    in_memory = url.database in (None, '', ':memory:')
+    if not in_memory:
+        os.makedirs(os.path.dirname(os.path.abspath(url.database)), exist_ok=True)
+
+    connect_args = {'check_same_thread': False, 'timeout': 30}
+    if in_memory:
+        # Every pooled connection would otherwise open its own empty database
+        engine = create_engine(database_url, connect_args=connect_args, poolclass=StaticPool)
+    else:
+        engine = create_engine(database_url, connect_args=connect_args)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in PRAGMAS.items():
+            if name == 'journal_mode' and in_memory:
+                continue
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
+
+class SQLiteWriter:
+    """Serializes all writes to a SQLite database through one thread.
+
+    Jobs queued while a transaction is running are committed together in the
+    next one, so concurrent request threads share a single fsync instead of
+    contending for the database lock.
+    """
+
+    def __init__(self, engine, max_batch=1000):
+        self.engine = engine
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    def insert(self, table, rows: list) -> Future:
+        """Queue rows for insertion into table"""
+        return self._enqueue(('insert', [(table, rows)], None))
+
+    def insert_batches(self, batches: list) -> Future:
+        """Queue several (table, rows) batches that must commit together"""
+        return self._enqueue(('insert', batches, None))
+
+    def submit(self, fn) -> Future:
+        """Queue fn(connection) to run inside the writer's transaction"""
+        return self._enqueue(('call', fn, None))
+
+    def _enqueue(self, job):
+        future = Future()
+        self._queue.put((job, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._commit(batch)
+            except Exception as e:
+                # Never let one bad batch end the thread every writer waits on
+                logger.error(f"SQLite writer failed on a batch of {len(batch)}: {e}", exc_info=True)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _commit(self, batch):
+        try:
+            with self.engine.begin() as conn:
+                results = self._execute(conn, batch)
+        except Exception as e:
+            logger.warning(f"SQLite write batch of {len(batch)} failed, retrying jobs individually: {e}")
+            self._run_individually(batch)
+            return
+
+        # Results are only published once the transaction has committed
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _run_individually(self, batch):
+        for job, future in batch:
+            try:
+                with self.engine.begin() as conn:
+                    result = self._execute(conn, [(job, future)])[0]
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def _execute(self, conn, batch):
+        """Run a batch in one transaction, grouping inserts per table"""
+        inserts = {}
+        for job, _ in batch:
+            if job[0] == 'insert':
+                for table, rows in job[1]:
+                    for row in rows:
+                        inserts.setdefault((table, tuple(sorted(row))), []).append(row)
+        for (table, _), rows in inserts.items():
+            conn.execute(insert(table), rows)
+
+        return [job[1](conn) if job[0] == 'call' else None for job, _ in batch]
@@ -0,0 +1,56 @@
+"""
+Standalone collector agent.
+
+Runs only the collectors named in COLLECTORS and uploads their samples to
+SERVER_URL, without importing the Flask/SQLAlchemy server stack:
+
+    COLLECTORS=pc python -m src.services.agent
+
+Add `python -X importtime` to see where startup time goes.
+"""
+import time
+
+_started = time.perf_counter()
+
+import logging
+import sys
+from ..config.logging_config import setup_logging
+from ..config.settings import settings
+from .collector_agent import CollectorAgent
+from .registry import CollectorRegistry, parse_plugins
+
+logger = logging.getLogger(__name__)
+
+def resident_memory_mb():
+    """Peak resident set size of this process in MB, or None if unavailable"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def create_agent(server_url=None, names=None, registry=None) -> CollectorAgent:
+    """Build a CollectorAgent with the enabled collectors from the registry"""
+    registry = registry or CollectorRegistry(parse_plugins(settings.COLLECTOR_PLUGINS))
+    if names is None:
+        names = [name.strip() for name in settings.COLLECTORS.split(',') if name.strip()]
+
+    agent = CollectorAgent(server_url or settings.SERVER_URL)
+    for collector in registry.create(names):
+        agent.add_collector(collector)
+    return agent
+
+def main():
+    setup_logging()
+    agent = create_agent()
+
+    startup_ms = (time.perf_counter() - _started) * 1000
+    rss = resident_memory_mb()
+    memory = f", {rss:.1f} MB resident" if rss is not None else ""
+    logger.info(f"Agent started with {len(agent.collectors)} collector(s) in {startup_ms:.0f} ms{memory}")
+    agent.collect_and_upload()
+
+if __name__ == '__main__':
+    main()
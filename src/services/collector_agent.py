@@ -5,14 +5,17 @@ from datetime import datetime
 from urllib.parse import urljoin
 import logging
 import os
+from .uploader_queue import UploaderQueue
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class CollectorAgent:
     def __init__(self, base_url=None):
         self.collectors = []
         self.base_url = base_url or os.getenv('SERVER_URL', 'http://localhost:5000')
+        # Samples wait here until the server accepts them, so outages don't lose data
+        self.uploads = UploaderQueue(max_items=int(os.getenv('AGENT_MAX_BUFFERED', 10000)))
+        self.batch_size = int(os.getenv('AGENT_BATCH_SIZE', 500))
         logger.info(f"CollectorAgent initialized with base_url: {self.base_url}")
 
     def add_collector(self, collector):
@@ -22,8 +25,9 @@ class CollectorAgent:
         while True:
             try:
                 metrics_data = self._collect_all_metrics()
-                if metrics_data and metrics_data["metrics"]:  # Check if we have any metrics
-                    self._send_to_server(metrics_data)
+                for sample in metrics_data["metrics"]:
+                    self.uploads.add(sample)
+                self._flush_uploads()
             except Exception as e:
                 logger.error(f"Error in collection cycle: {e}", exc_info=True)
             
@@ -43,26 +47,69 @@ class CollectorAgent:
                     metrics_collection["metrics"].append({
                         "device_id": metric_data.device_id,
                         "metric_type": metric_data.metric_type,
-                        "values": metric_data.values
+                        "values": metric_data.values,
+                        "timestamp": datetime.utcfromtimestamp(metric_data.timestamp).isoformat() + 'Z'
                     })
-                    logger.info(f"Collected {metric_data.metric_type} from {metric_data.device_id}")
+                    logger.debug("Collected %s from %s", metric_data.metric_type, metric_data.device_id)
             except Exception as e:
                 logger.error(f"Error collecting from {collector.__class__.__name__}: {e}")
 
         return metrics_collection
 
-    def _send_to_server(self, metrics_data):
-        """Send metrics to server endpoint"""
+    def _flush_uploads(self):
+        """Upload buffered samples in per-device batches, keeping whatever could not be sent"""
+        by_device = {}
+        for sample in self.uploads.get_all():
+            by_device.setdefault(sample["device_id"], []).append(sample)
+        batches = [
+            (device_id, samples[start:start + self.batch_size])
+            for device_id, samples in by_device.items()
+            for start in range(0, len(samples), self.batch_size)
+        ]
+
+        for index, (device_id, samples) in enumerate(batches):
+            unsent = self._upload(device_id, samples)
+            if unsent:
+                self.uploads.requeue(unsent + [sample for _, later in batches[index + 1:] for sample in later])
+                logger.warning(f"Upload failed, {len(self.uploads)} samples buffered for retry")
+                break
+
+    def _upload(self, device_id, samples):
+        """Send one batch, halving it while the server finds it too large; return the samples to retry"""
+        status = self._send_to_server({
+            "timestamp": datetime.utcnow().isoformat() + 'Z',
+            "metrics": samples
+        }, device_id)
+        if status is None or status == 429 or status >= 500:
+            return samples
+        if status == 413 and len(samples) > 1:
+            half = len(samples) // 2
+            self.batch_size = min(self.batch_size, half)
+            unsent = self._upload(device_id, samples[:half])
+            return unsent + samples[half:] if unsent else self._upload(device_id, samples[half:])
+        # Accepted, or rejected sample by sample; retrying would fail the same way
+        return []
+
+    def _send_to_server(self, metrics_data, device_id=None):
+        """Send metrics to server endpoint; return the response status, or None if it was unreachable"""
         try:
             endpoint = urljoin(self.base_url, "/metrics/snapshot")
-            logger.info(f"Sending metrics batch to {endpoint}: {metrics_data}")
+            logger.debug("Sending metrics batch to %s: %s", endpoint, metrics_data)
             
             response = requests.post(
                 endpoint,
                 json=metrics_data,
+                # Lets the server rate-limit the device before parsing the body
+                headers={"X-Device-Id": device_id} if device_id else None,
                 timeout=10
             )
-            response.raise_for_status()
-            logger.info(f"Server response: {response.status_code} - {response.text}")
+            if response.status_code >= 400:
+                logger.error(f"Server did not accept metrics ({response.status_code}): {response.text}")
+            elif "json" in response.headers.get("Content-Type", "") and response.json().get("rejected"):
+                logger.warning(f"Server rejected samples: {response.json()['rejected']}")
+            else:
+                logger.debug("Server response: %s - %s", response.status_code, response.text)
+            return response.status_code
         except requests.exceptions.RequestException as e:
-            logger.error(f"Error sending metrics to server: {e}") 
\ No newline at end of file
+            logger.error(f"Error sending metrics to server: {e}")
+            return None
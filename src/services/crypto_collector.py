@@ -4,7 +4,6 @@ from ..models.collector import CollectorInterface
 from ..models.metric_data import MetricData
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class CryptoCollector(CollectorInterface):
@@ -27,11 +26,11 @@ class CryptoCollector(CollectorInterface):
         
         # Check if it's time to update
         if current_time - self.last_update < self.update_interval:
-            logger.info("Not time to update crypto prices yet")
+            logger.debug("Not time to update crypto prices yet")
             return None
 
         try:
-            logger.info("Fetching crypto prices")
+            logger.debug("Fetching crypto prices")
             
             params = {
                 "ids": "bitcoin,ethereum",
@@ -46,7 +45,7 @@ class CryptoCollector(CollectorInterface):
             response.raise_for_status()
             
             data = response.json()
-            logger.info("Crypto price data received")
+            logger.debug("Crypto price data received")
             
             # Format the prices data to match frontend expectations
             prices = {
@@ -54,7 +53,7 @@ class CryptoCollector(CollectorInterface):
                 "ethereum_usd": data['ethereum']['usd']
             }
             
-            logger.info(f"Processed prices: {prices}")
+            logger.debug("Processed prices: %s", prices)
             
             # Update the last update timestamp
             self.last_update = current_time
@@ -1,11 +1,11 @@
 from datetime import datetime
 import time
+from sqlalchemy import delete, insert
 from ..models.metric_data import MetricData
 from ..server.database import Database, UEFARanking
 import json
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class MetricsAggregator:
@@ -18,25 +18,26 @@ class MetricsAggregator:
         return f"metrics_{device_id}_{metric_type}"
 
     def save_metrics(self, metric_data: MetricData):
-        """Save metrics to the database using SQLAlchemy ORM"""
+        """Save metrics to the database through its writer"""
         if not metric_data or not metric_data.values:
             return
 
         try:
             # Handle UEFA rankings
             if metric_data.metric_type == "uefa_rankings":
-                # Clear existing rankings
-                self.session.query(UEFARanking).delete()
-                
-                # Insert new rankings
                 current_year = int(time.strftime("%Y"))
-                for ranking in metric_data.values["rankings"]:
-                    new_ranking = UEFARanking(
-                        club=ranking['team'],
-                        points=ranking['points'],
-                        year=current_year
-                    )
-                    self.session.add(new_ranking)
+                rankings = [{
+                    'club': ranking['team'],
+                    'points': ranking['points'],
+                    'year': current_year
+                } for ranking in metric_data.values["rankings"]]
+
+                def write(conn):
+                    # Replace existing rankings
+                    conn.execute(delete(UEFARanking))
+                    if rankings:
+                        conn.execute(insert(UEFARanking), rankings)
+                self.db.run_write(write)
             else:
                 # Handle dynamic metric tables
                 table_name = self.get_table_name(
@@ -44,15 +45,9 @@ class MetricsAggregator:
                     metric_data.metric_type
                 )
                 MetricModel = self.db.create_metric_table(table_name, metric_data.values)
-                
-                # Create new metric record
-                new_metric = MetricModel(**metric_data.values)
-                self.session.add(new_metric)
-
-            self.session.commit()
+                self.db.insert_rows(MetricModel.__table__, [metric_data.values])
         except Exception as e:
-            print(f"Database error: {e}")
-            self.session.rollback()
+            logger.error(f"Database error: {e}")
             raise
 
     def _handle_uefa_rankings(self, data):
@@ -65,14 +60,11 @@ class MetricsAggregator:
         })
         
         # Create new metric record
-        new_metric = MetricModel(
-            rankings=json.dumps(data['values']['rankings'])
-        )
+        new_metric = {'rankings': json.dumps(data['values']['rankings'])}
         
         # Set timestamp if provided
         if 'timestamp' in data:
-            new_metric.timestamp = datetime.fromisoformat(data['timestamp'].replace('Z', '+00:00'))
+            new_metric['timestamp'] = datetime.fromisoformat(data['timestamp'].replace('Z', '+00:00'))
         
-        self.session.add(new_metric)
-        self.session.commit()
+        self.db.insert_rows(MetricModel.__table__, [new_metric])
         logger.info(f"Saved UEFA rankings: {data['values']['rankings']}") 
\ No newline at end of file
@@ -0,0 +1,86 @@
+from importlib import import_module
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Installed packages can add collectors under this entry point group, e.g.
+#   [project.entry-points."metrics_agent.collectors"]
+#   disk = "my_package.disk:DiskCollector"
+ENTRY_POINT_GROUP = 'metrics_agent.collectors'
+
+# Built-in collectors as "module:Class" targets, relative to this package
+BUILTIN_COLLECTORS = {
+    'pc': '.pc_collector:PCCollector',
+    'crypto': '.crypto_collector:CryptoCollector'
+}
+
+def parse_plugins(value: str) -> dict:
+    """Parse 'disk=my_package.disk:DiskCollector,...' into {name: target}"""
+    plugins = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, sep, target = item.partition('=')
+        if not sep or ':' not in target:
+            raise ValueError(f"Invalid collector plugin: {item}")
+        plugins[name.strip()] = target.strip()
+    return plugins
+
+class CollectorRegistry:
+    """Maps collector names to "module:Class" targets and imports them on demand.
+
+    Nothing is imported until a collector is loaded, so an agent only pays
+    the import cost (and dependencies) of the collectors it enables.
+    """
+
+    def __init__(self, plugins: dict = None):
+        self._targets = dict(BUILTIN_COLLECTORS)
+        self._targets.update(plugins or {})
+        self._entry_points = None
+        self._classes = {}
+
+    def register(self, name: str, target):
+        """Register a "module:Class" string or a collector class under name"""
+        self._targets[name] = target
+        self._classes.pop(name, None)
+
+    def available(self) -> list:
+        return sorted({*self._targets, *self._discover()})
+
+    def load(self, name: str):
+        """Import and return the collector class registered as name"""
+        if name in self._classes:
+            return self._classes[name]
+
+        started = time.perf_counter()
+        target = self._targets.get(name)
+        if target is None:
+            entry_point = self._discover().get(name)
+            if entry_point is None:
+                raise KeyError(f"Unknown collector: {name} (available: {', '.join(self.available())})")
+            cls = entry_point.load()
+        elif isinstance(target, str):
+            module_name, _, class_name = target.partition(':')
+            cls = getattr(import_module(module_name, package=__package__), class_name)
+        else:
+            cls = target
+
+        logger.debug("Loaded collector %s in %.1f ms", name, (time.perf_counter() - started) * 1000)
+        self._classes[name] = cls
+        return cls
+
+    def create(self, names: list) -> list:
+        """Instantiate the named collectors, skipping any that fail to load"""
+        collectors = []
+        for name in names:
+            try:
+                collectors.append(self.load(name)())
+            except Exception as e:
+                logger.error(f"Error loading collector {name}: {e}")
+        return collectors
+
+    def _discover(self) -> dict:
+        """Entry points of installed packages, looked up at most once"""
+        if self._entry_points is None:
+            from importlib.metadata import entry_points
+            self._entry_points = {ep.name: ep for ep in entry_points(group=ENTRY_POINT_GROUP)}
+        return self._entry_points
@@ -1,16 +1,29 @@
+from collections import deque
 import threading
 
 class UploaderQueue:
-    def __init__(self):
-        self.queue = []
+    """Buffers samples between uploads, dropping the oldest beyond max_items"""
+
+    def __init__(self, max_items=10000):
+        self.max_items = max_items
+        self.queue = deque(maxlen=max_items)
         self._lock = threading.Lock()
 
     def add(self, data):
         with self._lock:
             self.queue.append(data)
 
+    def requeue(self, items):
+        """Put items that failed to upload back in front of newer ones"""
+        with self._lock:
+            pending = list(items) + list(self.queue)
+            self.queue = deque(pending[-self.max_items:], maxlen=self.max_items)
+
     def get_all(self):
         with self._lock:
-            data = self.queue.copy()
+            data = list(self.queue)
             self.queue.clear()
-            return data 
\ No newline at end of file
+            return data
+
+    def __len__(self):
+        return len(self.queue)
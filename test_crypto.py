@@ -1,9 +1,10 @@
 from src.services.crypto_collector import CryptoCollector
 from src.services.collector_agent import CollectorAgent
+from src.config.logging_config import setup_logging
 import logging
 import time
 
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 def test_crypto_collection():
@@ -16,7 +17,7 @@ def test_crypto_collection():
     
     # Run one collection cycle
     metrics_data = agent._collect_all_metrics()
-    logger.info(f"Collected metrics: {metrics_data}")
+    logger.info("Collected metrics: %s", metrics_data)
     
     # Send to server
     agent._send_to_server(metrics_data)
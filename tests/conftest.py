@@ -0,0 +1,18 @@
+import pytest
+from flask import Flask
+from src.server.routes import MetricsAPI
+
+@pytest.fixture
+def database_url(tmp_path):
+    return f"sqlite:///{tmp_path / 'metrics.db'}"
+
+@pytest.fixture
+def api(database_url, tmp_path, monkeypatch):
+    monkeypatch.setenv('ARCHIVE_DIR', str(tmp_path / 'archive'))
+    return MetricsAPI(database_url)
+
+@pytest.fixture
+def client(api):
+    app = Flask(__name__)
+    api.init_routes(app)
+    return app.test_client()
@@ -0,0 +1,78 @@
+from flask import Flask, jsonify, request
+import pytest
+from src.server.admission import AdmissionController, TokenBucket
+
+def test_token_bucket_refills():
+    bucket = TokenBucket(rate=2.0, capacity=4, now=0.0)
+    assert bucket.consume(0.0, 4) == 0
+    assert bucket.consume(0.0) == pytest.approx(0.5)
+    assert bucket.consume(1.0, 2) == 0
+
+def make_client(**limits):
+    controller = AdmissionController(**limits)
+    app = Flask(__name__)
+    controller.init_app(app, ['/ingest'])
+
+    @app.route('/ingest', methods=['POST'])
+    def ingest():
+        data = request.json
+        rejected = controller.check_device(data['device_id'], data.get('samples', 1))
+        return rejected or jsonify({"ok": True})
+
+    return controller, app.test_client()
+
+def post(client, device_id, samples=1, **headers):
+    return client.post('/ingest', json={'device_id': device_id, 'samples': samples}, headers=headers)
+
+def test_noisy_device_does_not_throttle_others():
+    controller, client = make_client(device_rate=1, device_burst=5, key_rate=1, key_burst=5)
+    statuses = [post(client, 'noisy').status_code for _ in range(20)]
+    assert statuses.count(200) == 5 and statuses.count(429) == 15
+    # Keyless requests share no bucket, so another device is unaffected
+    assert post(client, 'good').status_code == 200
+    assert controller.stats()['top_throttled_devices'] == {'noisy': 15}
+
+def test_api_key_and_address_buckets():
+    _, client = make_client(key_rate=1, key_burst=2)
+    assert [post(client, f'd{i}', **{'X-API-Key': 'k'}).status_code for i in range(3)] == [200, 200, 429]
+
+    _, client = make_client(key_rate=1, key_burst=2, limit_by_address=True)
+    response = [post(client, f'd{i}') for i in range(3)][-1]
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+
+def test_device_header_is_charged_once():
+    controller, client = make_client(device_rate=1, device_burst=3)
+    assert post(client, 'd', samples=3, **{'X-Device-Id': 'd'}).status_code == 200
+    assert post(client, 'd', **{'X-Device-Id': 'd'}).status_code == 429
+    assert controller.stats()['counters']['device_rate'] == 1
+
+def test_size_limits():
+    _, client = make_client(max_body_bytes=64, max_batch=10)
+    assert client.post('/ingest', data='x' * 100, content_type='application/json').status_code == 413
+    assert post(client, 'd', samples=11).status_code == 413
+
+def make_batch_client(**limits):
+    controller = AdmissionController(**limits)
+    app = Flask(__name__)
+    controller.init_app(app, ['/ingest'])
+
+    @app.route('/ingest', methods=['POST'])
+    def ingest():
+        counts = request.json
+        rejected = controller.check_batch(sum(counts.values())) or controller.check_devices(counts)
+        return rejected or jsonify({"ok": True})
+
+    return controller, app.test_client()
+
+def test_batch_limit_covers_all_devices():
+    _, client = make_batch_client(max_batch=5)
+    assert client.post('/ingest', json={'a': 4, 'b': 4, 'c': 4, 'd': 4}).status_code == 413
+
+def test_throttled_batch_charges_no_device():
+    controller, client = make_batch_client(device_rate=0.001, device_burst=3)
+    assert client.post('/ingest', json={'a': 1, 'b': 3}).status_code == 200
+    response = client.post('/ingest', json={'a': 2, 'b': 1})
+    assert response.status_code == 429 and 'device b' in response.json['error']
+    # a still has its two tokens because the rejected batch took none
+    assert client.post('/ingest', json={'a': 2}).status_code == 200
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+import pytest
+from src.server.alerts import AlertEngine
+
+START = datetime(2026, 1, 1, 12, 0, 0)
+
+@pytest.fixture
+def engine(api):
+    events = []
+    alerts = AlertEngine(api.db, notifier=events.append)
+    alerts.events = events
+    return alerts
+
+def feed(engine, values, step=60, field='v', device_id='al'):
+    for i, value in enumerate(values):
+        engine.evaluate(device_id, 'load', {field: value}, START + timedelta(seconds=step * i))
+    return [(event['state'], event['value']) for event in engine.events]
+
+def test_threshold_with_hysteresis(engine):
+    engine.create_rule({'field': 'v', 'threshold': 90, 'clear_threshold': 80})
+    assert feed(engine, [50, 95, 85, 91, 79, 95]) == [('firing', 95), ('resolved', 79), ('firing', 95)]
+    [open_alert] = engine.list_alerts(state='firing')
+    assert open_alert['device_id'] == 'al' and open_alert['value'] == 95
+
+def test_rate_rule_compares_against_window_reference(engine):
+    engine.create_rule({'kind': 'rate', 'field': 'v', 'threshold': 50, 'window': 300})
+    # Reference 100 at t=0; 160 is +60% within the window
+    assert feed(engine, [100, 120, 160]) == [('firing', 60.0)]
+
+def test_window_avg_smooths_spikes(engine):
+    engine.create_rule({'kind': 'window_avg', 'field': 'v', 'threshold': 50, 'window': 600})
+    assert feed(engine, [10, 100, 10, 10]) == []
+    events = feed(engine, [100] * 20)
+    assert events[0][0] == 'firing' and events[0][1] > 50
+
+def test_rules_filter_by_device_and_tag(engine):
+    engine.create_rule({'field': 'v', 'threshold': 1, 'device_id': 'other'})
+    engine.create_rule({'field': 'v', 'threshold': 1, 'tag': 'site=dub'})
+    engine.evaluate('al', 'load', {'v': 5}, START, {'site': 'cork'})
+    engine.evaluate('al', 'load', {'v': 5}, START, {'site': 'dub'})
+    assert [event['rule_id'] for event in engine.events] == [2]
+
+def test_invalid_rules_are_rejected(engine):
+    for spec in ({'field': 'v', 'threshold': 1, 'window': -5},
+                 {'field': 'v', 'threshold': 1, 'kind': 'median'},
+                 {'threshold': 1}):
+        with pytest.raises(ValueError):
+            engine.create_rule(spec)
+
+def test_deleting_a_rule_resolves_its_alerts(engine):
+    rule_id = engine.create_rule({'field': 'v', 'threshold': 1})
+    feed(engine, [5])
+    assert engine.delete_rule(rule_id)
+    assert engine.list_alerts(state='firing') == []
+    assert engine.list_alerts()[0]['resolved_at'] is not None
+    assert not engine.delete_rule(999)
+
+def test_rule_route_rejects_negative_window(client):
+    response = client.post('/alerts/rules', json={'field': 'v', 'threshold': 1, 'window': -1})
+    assert response.status_code == 400
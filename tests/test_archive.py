@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+def archive_rows(api, table_name, stamps):
+    model = api.db.create_metric_table(table_name, {'value': 'FLOAT'})
+    api.db.insert_rows(model.__table__, [{'timestamp': stamp, 'value': float(i)}
+                                         for i, stamp in enumerate(stamps)])
+    api.storage.archive(timedelta(days=1))
+    return model
+
+def test_aggregate_excludes_the_end_of_the_range(api):
+    start = datetime.combine((datetime.utcnow() - timedelta(days=10)).date(), datetime.min.time())
+    archive_rows(api, 'metrics_half_archive', [start, start + timedelta(minutes=1)])
+    end = start + timedelta(minutes=1)
+
+    rows = api.storage.aggregate([('half', 'metrics_half_archive', 'value')], start, end, 3600, [], False)
+    assert [row['_count'] for row in rows] == [1]
+    # History reads stay inclusive
+    assert len(api.storage.read_rows('metrics_half_archive', start, end)) == 2
+
+def test_rewritten_day_keeps_each_row_once(api):
+    start = datetime.combine((datetime.utcnow() - timedelta(days=10)).date(), datetime.min.time())
+    archive_rows(api, 'metrics_dup_archive', [start, start + timedelta(minutes=1)])
+    entry = api.storage.archived_days('metrics_dup_archive', start, start)[0]
+    rows = pq.read_table(os.path.join(api.storage.archive_dir, entry['file'])).to_pylist()
+
+    # A pass whose delete failed writes the same rows again, plus a late one
+    late = {'id': 3, 'timestamp': start + timedelta(minutes=2), 'value': 2.0}
+    api.storage._write_day(pa, 'metrics_dup_archive', start, rows + [late])
+
+    table = api.storage.read('metrics_dup_archive', start, start + timedelta(days=1))
+    assert sorted(table['id'].to_pylist()) == [1, 2, 3]
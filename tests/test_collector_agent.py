@@ -0,0 +1,42 @@
+from unittest import mock
+import requests
+from src.services.collector_agent import CollectorAgent
+
+def buffered_agent(count, batch_size=8):
+    agent = CollectorAgent('http://server')
+    agent.batch_size = batch_size
+    for i in range(count):
+        agent.uploads.add({'device_id': 'a', 'metric_type': 't', 'values': {'v': i}})
+    return agent
+
+def respond(status):
+    return mock.Mock(status_code=status, text='', headers={})
+
+def test_batches_too_large_are_split_not_dropped():
+    sent = []
+
+    def post(url, json, headers, timeout):
+        if len(json['metrics']) > 2:
+            return respond(413)
+        sent.extend(sample['values']['v'] for sample in json['metrics'])
+        return respond(200)
+
+    agent = buffered_agent(7)
+    with mock.patch('requests.post', side_effect=post):
+        agent._flush_uploads()
+    assert sent == list(range(7))
+    assert len(agent.uploads) == 0
+    assert agent.batch_size <= 2
+
+def test_unreachable_server_keeps_samples_in_order():
+    agent = buffered_agent(5, batch_size=2)
+    with mock.patch('requests.post', side_effect=requests.exceptions.ConnectionError('down')):
+        agent._flush_uploads()
+    assert [sample['values']['v'] for sample in agent.uploads.get_all()] == list(range(5))
+
+def test_rejected_batches_are_not_retried():
+    agent = buffered_agent(3)
+    with mock.patch('requests.post', return_value=respond(400)) as post:
+        agent._flush_uploads()
+    assert post.call_count == 1
+    assert len(agent.uploads) == 0
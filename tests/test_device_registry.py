@@ -0,0 +1,26 @@
+from datetime import datetime
+
+def test_latest_values_follow_event_time(api):
+    devices = api.devices
+    devices.record('reg', 'load', {'value': 1.0}, datetime(2026, 1, 1, 1, 0, 0))
+    devices.flush()
+    devices.record('reg', 'load', {'value': 2.0}, datetime(2026, 1, 1, 1, 0, 0, 500000))
+    devices.record('reg', 'cpu', {'value': 3.0}, datetime(2026, 1, 1, 1, 0, 0))
+    devices.flush()
+    devices.record('reg', 'cpu', {'value': 4.0}, datetime(2026, 1, 1, 0, 59, 59))  # Late sample
+    devices.flush()
+
+    [device] = devices.overview()['devices']
+    assert device['latest']['load'] == {'timestamp': '2026-01-01T01:00:00.500000Z', 'values': {'value': 2.0}}
+    assert device['latest']['cpu']['values'] == {'value': 3.0}
+    assert device['metric_types'] == ['cpu', 'load']
+
+def test_tag_filters(api):
+    for device_id, site in (('t1', 'dub'), ('t2', 'dub'), ('t3', 'cork')):
+        api.devices.record(device_id, 'load', {'value': 1.0})
+        api.devices.set_tags(device_id, {'site': site, 'role': 'edge'})
+
+    assert api.devices.devices_with_tags({'site': 'dub', 'role': 'edge'}) == {'t1', 't2'}
+    page = api.devices.overview(limit=1, tags={'site': 'dub'})
+    assert [d['device_id'] for d in page['devices']] == ['t1'] and page['next_after'] == 't1'
+    assert api.devices.tags_for('t3') == {'site': 'cork', 'role': 'edge'}
@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+import pytest
+
+def iso(moment):
+    return moment.isoformat() + 'Z'
+
+def sample(device_id='ing', metric_type='ingest', timestamp=None, **values):
+    entry = {'device_id': device_id, 'metric_type': metric_type, 'values': values or {'value': 1.0}}
+    if timestamp is not None:
+        entry['timestamp'] = timestamp
+    return entry
+
+def test_parse_samples_validates_timestamps(api):
+    now = datetime.utcnow()
+    samples, rejected = api._parse_samples({
+        'timestamp': iso(now - timedelta(minutes=5)),
+        'metrics': [
+            sample(timestamp=iso(now - timedelta(minutes=1))),
+            sample(),  # Falls back to the batch timestamp
+            sample(timestamp=iso(now + timedelta(hours=1))),
+            sample(timestamp=iso(now - timedelta(days=30))),
+            sample(timestamp='not a time'),
+            {'device_id': 'ing'}
+        ]
+    })
+    assert [s['timestamp'] for s in samples] == [now - timedelta(minutes=1), now - timedelta(minutes=5)]
+    assert [item['index'] for item in rejected] == [2, 3, 4, 5]
+    assert 'ahead of server time' in rejected[0]['error']
+    assert 'older than' in rejected[1]['error']
+    assert rejected[2]['error'] == 'Invalid timestamp: not a time'
+
+def test_parse_samples_rejects_malformed_batches(api):
+    for payload in (None, [], {'metrics': []}, {'metrics': 'x'}):
+        with pytest.raises(ValueError):
+            api._parse_samples(payload)
+
+def test_batch_keeps_valid_samples(client):
+    now = datetime.utcnow()
+    response = client.post('/metrics/snapshot', json={'metrics': [
+        sample(timestamp=iso(now - timedelta(minutes=2)), value=1.0),
+        sample(timestamp=iso(now + timedelta(days=1)), value=2.0),
+        sample(timestamp=iso(now - timedelta(minutes=1)), value=3.0)
+    ]})
+    assert response.status_code == 200
+    assert response.json['accepted'] == 2
+    assert [item['index'] for item in response.json['rejected']] == [1]
+
+    history = client.get('/metrics/history/ing/ingest').json
+    assert [row['value'] for row in history['data']] == [1.0, 3.0]
+
+def test_unknown_fields_are_rejected(client):
+    assert client.post('/metrics/snapshot', json=sample('unk', ram_usage=1.0)).status_code == 200
+    response = client.post('/metrics/snapshot', json=sample('unk', ram_usage=50.0, new_field=3.0))
+    assert response.status_code == 400
+    assert response.json['error'] == 'Unknown fields for metrics_unk_ingest: new_field'
+
+def test_late_samples_reach_incremental_clients(client):
+    now = datetime.utcnow()
+    client.post('/metrics/snapshot', json=sample(timestamp=iso(now - timedelta(minutes=1)), value=1.0))
+    cursor = client.get('/metrics/history/ing/ingest').json['cursor']
+
+    client.post('/metrics/snapshot', json=sample(timestamp=iso(now - timedelta(hours=2)), value=2.0))
+    delta = client.get(f'/metrics/history/ing/ingest?since={cursor}').json
+    assert [row['value'] for row in delta['data']] == [2.0]
+    assert client.get(f"/metrics/history/ing/ingest?since={delta['cursor']}").json['data'] == []
+
+def test_cursor_survives_archiving_a_whole_table(client, api):
+    old = datetime.utcnow() - timedelta(days=100)
+    model = api.db.create_metric_table('metrics_arc_ingest', {'value': 'FLOAT'})
+    api.db.insert_rows(model.__table__, [{'timestamp': old + timedelta(seconds=i), 'value': float(i)}
+                                         for i in range(3)])
+    first = client.get('/metrics/history/arc/ingest?range=30d').json
+    api.storage.archive(timedelta(days=30))
+
+    client.post('/metrics/snapshot', json=sample(device_id='arc', value=9.0))
+    delta = client.get(f"/metrics/history/arc/ingest?since={first['cursor'] or 'id:3'}").json
+    assert [row['value'] for row in delta['data']] == [9.0]
+
+def test_cursor_survives_id_reuse_on_existing_tables(client, api):
+    with api.db.engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE metrics_leg_ingest (id INTEGER PRIMARY KEY, timestamp DATETIME, value FLOAT)")
+    model = api.db.get_metric_table('metrics_leg_ingest')
+    old = datetime.utcnow() - timedelta(days=3)
+    api.db.insert_rows(model.__table__, [{'timestamp': old + timedelta(seconds=i), 'value': float(i)}
+                                         for i in range(3)])
+    cursor = client.get('/metrics/history/leg/ingest?range=7d').json['cursor']
+    api.storage.archive(timedelta(days=1))
+
+    # The table is empty again, so SQLite hands out id 1 a second time
+    client.post('/metrics/snapshot', json=sample(device_id='leg', value=9.0))
+    delta = client.get(f'/metrics/history/leg/ingest?range=7d&since={cursor}').json
+    assert [row['value'] for row in delta['data']] == [9.0]
+
+    full = client.get('/metrics/history/leg/ingest?range=7d').json
+    assert [row['value'] for row in full['data']] == [0.0, 1.0, 2.0, 9.0]
+
+def test_history_rows_carry_ids(client):
+    stamp = iso(datetime.utcnow() - timedelta(minutes=1))
+    client.post('/metrics/snapshot', json={'metrics': [sample('ids', timestamp=stamp, value=1.0),
+                                                       sample('ids', timestamp=stamp, value=2.0)]})
+    rows = client.get('/metrics/history/ids/ingest').json['data']
+    assert len({row['id'] for row in rows}) == 2
+
+def test_nested_values_and_bad_tags_are_rejected_per_sample(api):
+    samples, rejected = api._parse_samples({'metrics': [
+        sample(value=1.0),
+        sample(value={'nested': 1}),
+        sample(value=[1, 2]),
+        {**sample(), 'tags': ['rack']},
+        {**sample(), 'tags': {'rack': {'row': 1}}},
+        {**sample(), 'tags': {'rack': 'a1', 'floor': 2}}
+    ]})
+    assert [s['index'] for s in samples] == [0, 5]
+    assert [item['index'] for item in rejected] == [1, 2, 3, 4]
+    assert rejected[0]['error'] == 'Values must be scalars: value'
+
+def test_post_commit_errors_do_not_fail_the_request(client, api, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(api.alerts, 'evaluate', broken)
+    response = client.post('/metrics/snapshot', json=sample('pce', value=4.0))
+    assert response.status_code == 200
+    assert [row['value'] for row in client.get('/metrics/history/pce/ingest').json['data']] == [4.0]
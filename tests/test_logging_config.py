@@ -0,0 +1,32 @@
+import logging
+import queue
+from src.config.logging_config import RateLimitFilter, _DeferredQueueHandler, parse_levels
+
+def record(level=logging.INFO, lineno=1, created=0.0):
+    entry = logging.LogRecord('test', level, __file__, lineno, 'message', None, None)
+    entry.created = created
+    return entry
+
+def test_rate_limit_filter_counts_suppressed_records():
+    limiter = RateLimitFilter(interval=10, burst=2)
+    assert [limiter.filter(record(created=t)) for t in (0, 1, 2, 3)] == [True, True, False, False]
+    assert limiter.filter(record(logging.ERROR, created=4))
+    resumed = record(created=11)
+    assert limiter.filter(resumed) and resumed.suppressed == 2
+
+def test_full_queue_drops_info_but_keeps_errors(capsys):
+    handler = _DeferredQueueHandler(queue.Queue(maxsize=1), block_timeout=0.01)
+    handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+    handler.enqueue(record())
+    handler.enqueue(record())
+    handler.enqueue(record(logging.ERROR))
+    assert handler.dropped == 1
+    assert capsys.readouterr().err == 'ERROR message\n'
+
+    handler.queue.get_nowait()
+    next_record = record()
+    handler.enqueue(next_record)
+    assert next_record.dropped == 1
+
+def test_parse_levels():
+    assert parse_levels('a=debug, b.c=WARNING,') == {'a': 'DEBUG', 'b.c': 'WARNING'}
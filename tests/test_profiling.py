@@ -0,0 +1,38 @@
+from flask import Flask
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from src.server.profiling import Profiling
+
+@pytest.fixture
+def profiled(tmp_path):
+    profiling = Profiling(tmp_path / 'profiles', sample_rate=1.0, slow_query_ms=0, token='secret',
+                          max_profiles=3)
+    app = Flask(__name__)
+    engine = create_engine('sqlite://')
+    profiling.init_app(app, engine)
+
+    @app.route('/work')
+    def work():
+        return 'ok'
+
+    return profiling, app.test_client(), engine
+
+def test_profiles_are_capped(profiled):
+    profiling, client, _ = profiled
+    names = [client.get('/work').headers['X-Profile-Id'] for _ in range(6)]
+    assert sorted(client.get('/debug/profiles', headers={'X-Profile-Token': 'secret'}).json) == names[-3:]
+
+def test_debug_routes_require_token(profiled):
+    _, client, _ = profiled
+    assert client.get('/debug/slow').status_code == 403
+    assert client.get('/debug/slow?limit=x', headers={'X-Profile-Token': 'secret'}).status_code == 400
+
+def test_failed_statements_do_not_leak_timers(profiled):
+    _, _, engine = profiled
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM missing"))
+        conn.execute(text("SELECT 1"))
+        assert conn.connection.info.get('query_start') in (None, [])
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+import pytest
+from src.server.query import parse_aggregations, parse_bucket, parse_time
+
+START = datetime(2026, 1, 5, 12, 0, 0)
+
+@pytest.fixture
+def loaded(api):
+    for device_id, values in (('q1', [10, 20, 30, 40]), ('q2', [50, 60])):
+        model = api.db.create_metric_table(f"metrics_{device_id}_load", {'value': 'FLOAT'})
+        api.db.insert_rows(model.__table__, [
+            {'timestamp': START + timedelta(seconds=20 * i), 'value': value}
+            for i, value in enumerate(values)
+        ])
+        # One sample in the following minute
+        api.db.insert_rows(model.__table__, [{'timestamp': START + timedelta(seconds=90), 'value': 1.0}])
+    return api
+
+def run(api, selector, aggregations, group_by_device=False):
+    return api.query.run(selector, START, START + timedelta(minutes=5), 60,
+                         aggregations, group_by_device)
+
+def test_parsers():
+    assert parse_bucket('5m') == 300
+    assert parse_bucket('1h') == 3600
+    with pytest.raises(ValueError):
+        parse_bucket('0s')
+    assert parse_time('2026-01-05T12:00:00Z') == START
+    assert parse_time('2026-01-05T13:00:00+01:00') == START
+    with pytest.raises(ValueError):
+        parse_aggregations('avg,median')
+
+def test_buckets_align_to_width(loaded):
+    [group] = run(loaded, 'q1:load:value', ['count', 'avg', 'min', 'max'])
+    first, second = group['points']
+    assert first == {'time': '2026-01-05T12:00:00Z', 'count': 3, 'avg': 20.0, 'min': 10.0, 'max': 30.0}
+    assert second['time'] == '2026-01-05T12:01:00Z'
+    assert second['count'] == 2 and second['avg'] == 20.5
+
+def test_nearest_rank_percentiles(loaded):
+    [group] = run(loaded, 'q1:load:value', ['p50', 'p95'])
+    assert group['points'][0]['p50'] == 20.0
+    assert group['points'][0]['p95'] == 30.0
+
+def test_wildcard_merges_or_groups_devices(loaded):
+    [merged] = run(loaded, '*:load:value', ['count'])
+    assert [point['count'] for point in merged['points']] == [5, 3]
+
+    grouped = run(loaded, '*:load:value', ['count'], group_by_device=True)
+    assert {group['device_id']: group['points'][0]['count'] for group in grouped} == {'q1': 3, 'q2': 2}
+
+def test_query_route_validates_input(client, loaded):
+    assert client.get('/metrics/query?series=q1:load:value&bucket=abc').status_code == 400
+    response = client.get('/metrics/query?series=q1:load:value&bucket=1m&agg=count'
+                          '&start=2026-01-05T12:00:00Z&end=2026-01-05T12:05:00Z')
+    assert response.status_code == 200
+    assert [point['count'] for point in response.json['series'][0]['groups'][0]['points']] == [3, 2]
@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from flask import Flask
+import pytest
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.exc import OperationalError
+from src.server.database import Database, DeviceCommand
+from src.server.routes import MetricsAPI
+from src.server.sqlite_backend import SQLiteWriter, create_sqlite_engine
+
+@pytest.fixture
+def writer(tmp_path):
+    engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'writer.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT NOT NULL)"))
+    return SQLiteWriter(engine)
+
+def count_items(engine):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT count(*) FROM items")).scalar()
+
+def test_failing_job_does_not_affect_others(writer):
+    good = writer.submit(lambda conn: conn.execute(text("INSERT INTO items (name) VALUES ('a')")).lastrowid)
+    bad = writer.submit(lambda conn: conn.execute(text("INSERT INTO items (name) VALUES (NULL)")))
+
+    assert good.result(timeout=5) == 1
+    with pytest.raises(Exception):
+        bad.result(timeout=5)
+    assert count_items(writer.engine) == 1
+
+def test_writer_survives_unexpected_errors(writer, monkeypatch):
+    original = writer._commit
+    calls = []
+
+    def commit_once_broken(batch):
+        calls.append(batch)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return original(batch)
+
+    monkeypatch.setattr(writer, '_commit', commit_once_broken)
+    with pytest.raises(RuntimeError):
+        writer.submit(lambda conn: None).result(timeout=5)
+
+    # The thread is still alive and serving jobs
+    future = writer.submit(lambda conn: conn.execute(text("INSERT INTO items (name) VALUES ('b')")))
+    future.result(timeout=5)
+    assert count_items(writer.engine) == 1
+
+def test_commit_failure_fails_the_job_and_keeps_the_writer(writer):
+    engine = writer.engine
+
+    class FailingCommit:
+        @contextmanager
+        def begin(self):
+            with engine.connect() as conn:
+                yield conn
+                raise OperationalError("COMMIT", {}, Exception("disk I/O error"))
+
+    writer.engine = FailingCommit()
+    with pytest.raises(OperationalError):
+        writer.submit(lambda conn: 1).result(timeout=5)
+
+    writer.engine = engine
+    assert writer._thread.is_alive()
+    assert writer.submit(lambda conn: 2).result(timeout=5) == 2
+
+def test_in_memory_database():
+    api = MetricsAPI('sqlite://')
+    app = Flask(__name__)
+    api.init_routes(app)
+    client = app.test_client()
+
+    response = client.post('/metrics/snapshot', json={
+        "device_id": "mem", "metric_type": "system_metrics",
+        "values": {"ram_usage": 12.5, "thread_count": 3}
+    })
+    assert response.status_code == 200
+    history = client.get('/metrics/history/mem/system_metrics').json
+    assert [row['ram_usage'] for row in history['data']] == [12.5]
+
+def test_concurrent_snapshots_and_commands(client, api):
+    def work(worker):
+        statuses = []
+        for i in range(20):
+            device_id = f"dev{worker}"
+            if i % 2:
+                response = client.post(f'/device/command/{device_id}', json={"command": f"cmd{i}"})
+            else:
+                response = client.post('/metrics/snapshot', json={
+                    "device_id": device_id, "metric_type": "load", "values": {"value": float(i)}
+                })
+            statuses.append(response.status_code)
+            statuses.append(client.get(f'/device/commands/{device_id}').status_code)
+        return statuses
+
+    with ThreadPoolExecutor(16) as pool:
+        statuses = [status for result in pool.map(work, range(16)) for status in result]
+
+    assert set(statuses) == {200}
+    with api.db.engine.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(DeviceCommand)).scalar() == 16 * 10
+    for worker in range(16):
+        table = api.db.get_metric_table(f"metrics_dev{worker}_load").__table__
+        with api.db.engine.connect() as conn:
+            assert conn.execute(select(func.count()).select_from(table)).scalar() == 10
+
+def test_databases_share_metric_models(database_url):
+    first, second = Database(database_url), Database(database_url)
+    assert first.create_metric_table('metrics_x_y', {'v': 'FLOAT'}) is \
+        second.create_metric_table('metrics_x_y', {'v': 'FLOAT'})
+
+def test_table_creation_goes_through_the_writer(database_url, monkeypatch):
+    db = Database(database_url)
+    submitted = []
+    submit = db.writer.submit
+    monkeypatch.setattr(db.writer, 'submit', lambda fn: submitted.append(fn) or submit(fn))
+    db.create_metric_table('metrics_ddl_y', {'v': 'FLOAT'})
+    assert submitted and 'metrics_ddl_y' in inspect(db.engine).get_table_names()